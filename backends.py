@@ -0,0 +1,163 @@
+"""Where table state is kept between requests.
+
+MemoryBackend (the default) keeps every table in this process only.
+SQLiteBackend keeps them in a SQLite database in WAL mode, so several worker
+processes can serve the same tables: writes are serialized by the database,
+readers pick up newer versions before using a table, and a poller thread tells
+each process about changes made by the others so it can push them to its own
+stream subscribers.
+
+Tables are duck-typed: a backend only uses `table_id`, `version`,
+`dump_state()` and `load_state(state, version)`, where a None state empties it.
+"""
+import contextlib
+import json
+import sqlite3
+import threading
+import time
+
+# Seconds between checks for changes committed by other processes
+POLL_INTERVAL = 0.02
+
+class MemoryBackend:
+    """Tables live in this process's memory and nowhere else"""
+    shared = False
+
+    def start(self, on_change):
+        pass
+
+    def refresh(self, table):
+        pass
+
+    def has_table(self, table_id):
+        return False
+
+    @contextlib.contextmanager
+    def writing(self, table):
+        yield
+
+    def close_table(self, table):
+        pass
+
+class SQLiteBackend:
+    """Tables stored as JSON rows in a SQLite database shared between processes.
+
+    Call `refresh(table)` before reading a table and wrap every mutation in
+    `with writing(table):`; both expect the caller to hold the table's lock.
+    `start(on_change)` runs a poller that calls `on_change(table_id, version)` for
+    every table changed in the database, including changes made by this process.
+    """
+    shared = True
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS tables ("
+        " id TEXT PRIMARY KEY, version INTEGER NOT NULL, seq INTEGER NOT NULL, state TEXT)",
+        "CREATE INDEX IF NOT EXISTS tables_seq ON tables (seq)",
+    )
+
+    def __init__(self, path, poll_interval=POLL_INTERVAL):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._idle = []
+        self._start_lock = threading.Lock()
+        self._poller = None
+        with self._connection() as conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextlib.contextmanager
+    def _connection(self):
+        # Request threads come and go, so connections are pooled rather than per-thread
+        try:
+            conn = self._idle.pop()
+        except IndexError:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            self._idle.append(conn)
+
+    def _refresh(self, conn, table):
+        row = conn.execute("SELECT version, state FROM tables WHERE id = ? AND version > ?",
+                           (table.table_id, table.version)).fetchone()
+        if row is not None:
+            version, state = row
+            # A NULL state is a closed table: start it over, keeping versions increasing
+            table.load_state(json.loads(state) if state is not None else None, version)
+
+    def has_table(self, table_id):
+        """Whether another process has stored this table (and not closed it)"""
+        with self._connection() as conn:
+            row = conn.execute("SELECT state IS NOT NULL FROM tables WHERE id = ?", (table_id,)).fetchone()
+        return bool(row and row[0])
+
+    def refresh(self, table):
+        """Load the stored state if another process has written a newer version"""
+        with self._connection() as conn:
+            self._refresh(conn, table)
+
+    @contextlib.contextmanager
+    def writing(self, table):
+        """Serialize a mutation across processes and store the result if it changed anything"""
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._refresh(conn, table)
+                version = table.version
+                yield
+                if table.version != version:
+                    self._store(conn, table.table_id, table.version, json.dumps(table.dump_state()))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def close_table(self, table):
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT version FROM tables WHERE id = ?", (table.table_id,)).fetchone()
+                self._store(conn, table.table_id, max(table.version, row[0] if row else 0) + 1, None)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _store(self, conn, table_id, version, state):
+        conn.execute(
+            "INSERT OR REPLACE INTO tables (id, version, seq, state) "
+            "VALUES (?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM tables), ?)",
+            (table_id, version, state)
+        )
+
+    def start(self, on_change):
+        """Start the change poller (idempotent)"""
+        if self._poller is not None:
+            return
+        with self._start_lock:
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll, args=(on_change,),
+                                                name='state-poller', daemon=True)
+                self._poller.start()
+
+    def _poll(self, on_change):
+        conn = self._connect()
+        seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM tables").fetchone()[0]
+        data_version = None
+        while True:
+            time.sleep(self.poll_interval)
+            # data_version only moves when another connection commits, so idle polls stay cheap
+            current = conn.execute("PRAGMA data_version").fetchone()[0]
+            if current == data_version:
+                continue
+            data_version = current
+            for table_id, version, row_seq in conn.execute(
+                    "SELECT id, version, seq FROM tables WHERE seq > ? ORDER BY seq", (seq,)).fetchall():
+                seq = max(seq, row_seq)
+                on_change(table_id, version)
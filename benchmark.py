@@ -0,0 +1,606 @@
+"""Benchmarks for the initiative tracker.
+
+Run with: python3 benchmark.py <benchmark> [options]
+Results are printed as JSON; --output also saves them, with the options and
+platform, to a file so runs can be compared.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import gzip
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
+import zlib
+
+from werkzeug.serving import make_server
+
+import card_app
+import metrics
+import sse
+
+def legacy_participant(name, traits, cards):
+    """A participant in the old free-form dict layout, with embedded card dicts"""
+    card_dicts = [dict(card_app.CARDS[c].dict) for c in cards]
+    return {
+        'name': name,
+        'traits': list(traits),
+        'cards': card_dicts,
+        'active_card': card_dicts[0] if card_dicts else None,
+        'trait_display': card_app.get_traits_display(card_app.trait_mask(traits)),
+        'additional_cards': [],
+        'has_drawn': bool(card_dicts)
+    }
+
+def slotted_participant(name, traits, cards):
+    p = card_app.Participant(name, card_app.trait_mask(traits), bytes(cards), has_drawn=bool(cards))
+    p.active_card = cards[0] if cards else None
+    return p
+
+def measure(build, count):
+    """Bytes allocated per participant when building `count` of them"""
+    rng = random.Random(0)
+    specs = [(f"Goblin {i}", rng.choice([[], ['quick'], ['level_headed']]), rng.sample(range(card_app.Card.COUNT), 2))
+             for i in range(count)]
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    built = [build(name, traits, cards) for name, traits, cards in specs]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    # Names are allocated up front and shared, so only the records themselves are counted
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    del built
+    return allocated / count
+
+def bench_memory(args):
+    legacy = measure(legacy_participant, args.participants)
+    slotted = measure(slotted_participant, args.participants)
+    return {
+        'participants': args.participants,
+        'legacy_dict_bytes_per_participant': round(legacy),
+        'slotted_bytes_per_participant': round(slotted),
+        'reduction': round(legacy / slotted, 2)
+    }
+
+def random_roster(rng, size):
+    return [{'name': f"Combatant {i}", 'traits': rng.sample(card_app.TRAITS, rng.randint(0, 2))}
+            for i in range(size)]
+
+def check_simulator(rng, rosters=200, rounds=500):
+    """Compare the vectorized simulator with draw_for_participant on the same decks.
+
+    Rosters go up to 20 people so decks also run out mid-round.  Returns the
+    number of rounds checked; raises AssertionError on the first mismatch.
+    """
+    np = card_app.np
+    np_rng = np.random.default_rng(rng.randrange(2**32))
+    checked = 0
+    for _ in range(rosters):
+        roster_traits = [card_app.trait_mask(p['traits']) for p in random_roster(rng, rng.randint(1, 20))]
+        order = card_app.shuffled_orders(np_rng, rounds, card_app.Card.COUNT)
+        active = card_app.simulate_active_cards(order, roster_traits)
+        positions = card_app.initiative_positions(active)
+        for r in range(rounds):
+            deck = card_app.Deck()
+            # Deck.draw takes cards from the end
+            deck.cards = bytearray(order[r, ::-1].tobytes())
+            expected = []
+            for traits in roster_traits:
+                card = card_app.get_active_from_initial(card_app.draw_for_participant(deck, traits), traits)
+                expected.append(card_app.NO_CARD if card is None else card)
+            assert active[r].tolist() == expected, (roster_traits, order[r].tolist())
+            keys = [card_app.SORT_KEY[c] if c != card_app.NO_CARD else -1 for c in expected]
+            ranked = sorted(range(len(keys)), key=keys.__getitem__, reverse=True)
+            assert [positions[r, i] for i in ranked] == list(range(len(keys)))
+            checked += 1
+    return checked
+
+def bench_simulate(args):
+    rng = random.Random(0)
+    result = {}
+    if card_app.np is not None:
+        result['equivalence_rounds_checked'] = check_simulator(rng)
+    roster = random_roster(rng, args.roster)
+    start = time.perf_counter()
+    card_app.simulate_initiative(roster, args.rounds, seed=0)
+    elapsed = time.perf_counter() - start
+    result.update({
+        'numpy': card_app.np is not None,
+        'roster': args.roster,
+        'rounds': args.rounds,
+        'seconds': round(elapsed, 3),
+        'rounds_per_second': round(args.rounds / elapsed)
+    })
+    return result
+
+def gm_client():
+    client = card_app.app.test_client()
+    client.post('/login', json={'password': card_app.GM_PASSWORD})
+    return client
+
+def time_next_rounds(client, table_ids, rounds):
+    """Mean seconds per /next_round request across the tables"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for table_id in table_ids:
+            client.post(f'/t/{table_id}/next_round', json={})
+    return (time.perf_counter() - start) / (rounds * len(table_ids))
+
+def bench_journal(args):
+    """/next_round latency with and without the journal, then time to recover every table"""
+    directory = tempfile.mkdtemp()
+    try:
+        client = gm_client()
+        table_ids = [f'bench{i}' for i in range(args.tables)]
+        roster = [{'op': 'deal_in', 'name': f'Combatant {i}'} for i in range(10)]
+        for table_id in table_ids:
+            client.post(f'/t/{table_id}/batch', json={'commands': roster})
+        plain = time_next_rounds(client, table_ids, 5)
+
+        card_app.open_journal(directory)
+        journaled = time_next_rounds(client, table_ids, 5)
+        entries = card_app.journal.seq
+        commits = card_app.journal.commits
+        card_app.journal.close()
+        card_app.journal = None
+
+        card_app.tables = card_app.TableRegistry()
+        start = time.perf_counter()
+        replayed = card_app.open_journal(directory)
+        recovery = time.perf_counter() - start
+        card_app.journal.close()
+        card_app.journal = None
+        return {
+            'tables': args.tables,
+            'next_round_ms': round(plain * 1000, 3),
+            'next_round_journaled_ms': round(journaled * 1000, 3),
+            'journal_entries': entries,
+            'group_commits': commits,
+            'entries_replayed': replayed,
+            'recovery_seconds': round(recovery, 4)
+        }
+    finally:
+        shutil.rmtree(directory)
+
+def bench_wire(args):
+    """Bytes on the wire for a table of --table-size participants over a session of rounds,
+    in each format"""
+    card_app.COALESCE_WINDOW = 0
+    frames = {(role, format): [] for role in card_app.ROLES for format in card_app.FORMATS}
+    card_app.sse_server.publish = lambda topic, frame: frames[topic[1:]].append(frame)
+    client = gm_client()
+    base = '/t/wire'
+    roster = [{'name': f'Combatant {i}', 'traits': random.Random(i).sample(card_app.TRAITS, i % 3)}
+              for i in range(args.table_size)]
+    gzip_headers = {'Accept-Encoding': 'gzip'}
+    sizes = {}
+    for route, body in (('/new_encounter', {'participants': roster}), ('/next_round', {})):
+        plain = client.post(base + route, json=body)
+        zipped = client.post(base + route, json=body, headers=gzip_headers)
+        sizes[route] = {'plain': len(plain.get_data()), 'gzip': len(zipped.get_data()),
+                        'encoding': zipped.headers.get('Content-Encoding', 'identity')}
+    plain = client.get(base + '/get_initiative')
+    zipped = client.get(base + '/get_initiative', headers=gzip_headers)
+    sizes['/get_initiative'] = {'plain': len(plain.get_data()), 'gzip': len(zipped.get_data()),
+                                'encoding': zipped.headers.get('Content-Encoding', 'identity')}
+    compact_headers = {'Accept': card_app.COMPACT_MIMETYPE}
+    plain = client.get(base + '/get_initiative', headers=compact_headers)
+    zipped = client.get(base + '/get_initiative', headers={**compact_headers, **gzip_headers})
+    sizes['/get_initiative compact'] = {'plain': len(plain.get_data()), 'gzip': len(zipped.get_data()),
+                                        'encoding': zipped.headers.get('Content-Encoding', 'identity')}
+
+    # Time to encode every participant once, which is what a snapshot costs each view
+    table = card_app.tables.get('wire')
+    encode_us = {}
+    for role, format in frames:
+        encode = card_app.ROLE_VIEWS[role, format][0]
+        participants = [p for p in table.participants if p.cards]
+        seconds = min(timeit.repeat(lambda: [encode(p) for p in participants], number=200, repeat=5)) / 200
+        encode_us[f'{role}/{format}'] = round(seconds * 1e6, 1)
+
+    # A viewer of each view joins, then watches rounds with a few extra draws and trait changes
+    for role, format in frames:
+        frames[role, format].append(table.subscribe(role, format))
+    rng = random.Random(1)
+    for _ in range(args.session_rounds):
+        client.post(base + '/next_round', json={})
+        for p in rng.sample(table.participants, 3):
+            client.post(base + '/draw_additional', json={'id': p.id})
+        client.post(base + '/update_traits', json={'id': rng.choice(table.participants).id, 'traits': ['quick']})
+
+    streams = {}
+    for (role, format), sent in frames.items():
+        compressor = sse.stream_compressor()
+        streams[f'{role}/{format}'] = {
+            'frames': len(sent),
+            'plain_bytes': sum(map(len, sent)),
+            'gzip_per_frame_bytes': sum(len(gzip.compress(f)) for f in sent),
+            'gzip_streaming_bytes': sum(len(compressor.compress(f) + compressor.flush(zlib.Z_SYNC_FLUSH))
+                                        for f in sent)
+        }
+    return {
+        'participants': args.table_size,
+        'json_responses': sizes,
+        'encode_us': encode_us,
+        'stream': streams
+    }
+
+def percentiles(samples):
+    """p50/p99/max of a list of seconds, in milliseconds"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {'p50_ms': round(pick(0.5) * 1000, 3), 'p99_ms': round(pick(0.99) * 1000, 3),
+            'max_ms': round(ordered[-1] * 1000, 3), 'count': len(ordered)}
+
+def resident_bytes():
+    """This process's resident memory, or None where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+def http_json(port, method, path, body=None, cookie=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    headers = {'Content-Type': 'application/json'}
+    if cookie:
+        headers['Cookie'] = cookie
+    try:
+        conn.request(method, path, json.dumps(body) if body is not None else None, headers)
+        response = conn.getresponse()
+        return response, json.loads(response.read() or b'null')
+    finally:
+        conn.close()
+
+async def watch_stream(sse_port, table_id, arrivals, connected, compressed):
+    """One spectator: record (table, version, time) for every frame it receives.  Like
+    a browser's EventSource it asks for gzip, unless `compressed` is False."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', sse_port, limit=1 << 24)
+    accept = "Accept-Encoding: gzip\r\n" if compressed else ""
+    writer.write(f"GET /t/{table_id}/stream?role=player HTTP/1.1\r\nHost: bench\r\n{accept}\r\n".encode())
+    headers = await reader.readuntil(b"\r\n\r\n")
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if b"Content-Encoding: gzip" in headers else None
+    pending = b""
+    first = True
+    try:
+        while True:
+            data = await reader.read(1 << 16)
+            if not data:
+                break
+            now = time.time()
+            pending += decompressor.decompress(data) if decompressor is not None else data
+            *frames, pending = pending.split(b"\n\n")
+            for frame in frames:
+                if frame.startswith(b"id: "):
+                    arrivals.append((table_id, int(frame[4:frame.index(b"\n")]), now))
+                if first:
+                    first = False
+                    connected()
+    finally:
+        writer.close()
+
+def run_gm(http_port, cookie, table_id, rounds, table_size, sent, request_times):
+    """Scripted GM for one table: an encounter, then rounds with extra draws and late arrivals"""
+    rng = random.Random(table_id)
+
+    def post(route, body):
+        start = time.time()
+        response, data = http_json(http_port, 'POST', f'/t/{table_id}/{route}', body, cookie)
+        request_times.append(time.time() - start)
+        if response.status == 200:
+            sent[(table_id, data['version'])] = start
+        return data
+
+    roster = [{'name': f'Combatant {i}', 'traits': rng.sample(card_app.TRAITS, i % 3)} for i in range(table_size)]
+    post('new_encounter', {'participants': roster})
+    for r in range(rounds):
+        state = post('next_round', {})
+        post('draw_additional', {'id': rng.choice(state['participants'])['id']})
+        post('deal_in', {'name': f'Reinforcement {r}', 'traits': []})
+
+def load_worker(conn, http_port, sse_port, options):
+    """Runs in its own process so the server's CPU and memory are measured on their own"""
+    table_ids = [f'load{i}' for i in range(options['tables'])]
+    arrivals = []
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    response, _ = http_json(http_port, 'POST', '/login', {'password': card_app.GM_PASSWORD})
+    cookie = response.getheader('Set-Cookie').split(';', 1)[0]
+    # Streams only open on tables that exist, which takes a GM change
+    for table_id in table_ids:
+        http_json(http_port, 'POST', f'/t/{table_id}/reset', {}, cookie)
+    connected = threading.Semaphore(0)
+    watchers = [asyncio.run_coroutine_threadsafe(
+        watch_stream(sse_port, table_ids[i % len(table_ids)], arrivals, connected.release,
+                     options['stream_encoding'] == 'gzip'), loop)
+        for i in range(options['subscribers'])]
+    for _ in range(options['subscribers']):
+        connected.acquire()
+    conn.send('subscribed')
+    conn.recv()
+
+    sent = {}
+    request_times = []
+    start = time.time()
+    with concurrent.futures.ThreadPoolExecutor(min(len(table_ids), 32)) as pool:
+        for future in [pool.submit(run_gm, http_port, cookie, table_id, options['rounds'], options['table_size'],
+                                   sent, request_times) for table_id in table_ids]:
+            future.result()
+    elapsed = time.time() - start
+    # Let the last broadcasts arrive
+    time.sleep(0.5)
+    latencies = [t - sent[key[:2]] for key in list(arrivals) for t in (key[2],) if key[:2] in sent]
+    conn.send({
+        'requests': len(request_times),
+        'seconds': elapsed,
+        'request_latency': percentiles(request_times),
+        'delivery_latency': percentiles(latencies),
+        'expected_deliveries': len(sent) * options['subscribers'] // len(table_ids)
+    })
+    # Stay connected while the server measures its memory again
+    conn.recv()
+    for watcher in watchers:
+        watcher.cancel()
+
+def bench_load(args):
+    """Scripted GMs on --load-tables tables while --subscribers spectators watch them.
+
+    The app runs here on real sockets; GMs and spectators run in a separate process.
+    Delivery latency is from sending a mutation to a spectator receiving its frame.
+    Server CPU per broadcast includes handling the request that caused it.
+    """
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    card_app.sse_server = sse.SSEServer('127.0.0.1', 0, card_app.open_stream, card_app.latest_frame)
+    card_app.sse_server.start()
+    http_server = make_server('127.0.0.1', 0, card_app.app, threaded=True)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+
+    options = {'tables': args.load_tables, 'subscribers': args.subscribers,
+               'rounds': args.load_rounds, 'table_size': args.table_size, 'stream_encoding': args.stream_encoding}
+    conn, child_conn = multiprocessing.Pipe()
+    worker = multiprocessing.get_context('spawn').Process(
+        target=load_worker, args=(child_conn, http_server.server_port, card_app.sse_server.port, options))
+    memory_before = resident_bytes()
+    worker.start()
+    try:
+        conn.recv()
+        memory_after = resident_bytes()
+        cpu_before = time.process_time()
+        conn.send('run')
+        result = conn.recv()
+        cpu = time.process_time() - cpu_before
+        # Compressors only touch most of their memory once they have had data to compress
+        memory_run = resident_bytes()
+        conn.send('done')
+    finally:
+        worker.join(5)
+        if worker.is_alive():
+            worker.kill()
+        http_server.shutdown()
+    broadcasts = result['requests']
+    return {
+        'tables': args.load_tables,
+        'subscribers': args.subscribers,
+        'stream_encoding': args.stream_encoding,
+        'participants_per_table': args.table_size,
+        'requests': result['requests'],
+        'requests_per_second': round(result['requests'] / result['seconds'], 1),
+        'request_latency': result['request_latency'],
+        'delivery_latency': result['delivery_latency'],
+        'deliveries_expected': result['expected_deliveries'],
+        'memory_per_subscriber_bytes': (round((memory_after - memory_before) / args.subscribers)
+                                        if memory_before is not None else None),
+        'memory_per_subscriber_after_run_bytes': (round((memory_run - memory_before) / args.subscribers)
+                                                  if memory_before is not None else None),
+        'server_cpu_ms_per_broadcast': round(cpu / broadcasts * 1000, 3)
+    }
+
+def bench_metrics(args):
+    """What the metrics cost per /next_round request.
+
+    The direct estimate counts the metric updates one request makes and prices
+    them and the request hooks with timeit.  The end-to-end figures compare runs
+    with the hooks removed and every update turned into a no-op; on a busy
+    machine they are much noisier than the difference they measure.
+    """
+    card_app.COALESCE_WINDOW = 0
+    card_app.sse_server.publish = lambda topic, frame: None
+    client = gm_client()
+    client.post('/t/metrics/batch', json={'commands': [{'op': 'deal_in', 'name': f'Combatant {i}'}
+                                                       for i in range(args.table_size)]})
+    for role in card_app.ROLES:
+        card_app.tables.get('metrics').subscribe(role)
+    hooks = [(card_app.app.before_request_funcs[None], card_app.start_timer),
+             (card_app.app.after_request_funcs[None], card_app.record_request)]
+    updates = {metrics._Buckets: 'observe', metrics._Value: 'inc'}
+    originals = {cls: getattr(cls, name) for cls, name in updates.items()}
+
+    def instrument(enabled, update=None):
+        for funcs, hook in hooks:
+            if enabled and hook not in funcs:
+                funcs.insert(0, hook) if hook is card_app.start_timer else funcs.append(hook)
+            elif not enabled and hook in funcs:
+                funcs.remove(hook)
+        for cls, name in updates.items():
+            setattr(cls, name, update or (originals[cls] if enabled else lambda self, value=1: None))
+
+    def per_request(enabled):
+        instrument(enabled)
+        start = time.perf_counter()
+        for _ in range(args.requests // 20):
+            client.post('/t/metrics/next_round', json={})
+        return (time.perf_counter() - start) / (args.requests // 20)
+
+    counted = []
+    try:
+        instrument(True, update=lambda self, value=1: counted.append(self))
+        client.post('/t/metrics/next_round', json={})
+        # Many short runs, alternating so drift affects both equally; keep the best of each
+        runs = {True: [], False: []}
+        for _ in range(20):
+            for enabled in (False, True):
+                runs[enabled].append(per_request(enabled))
+    finally:
+        instrument(True)
+    plain, instrumented = min(runs[False]), min(runs[True])
+
+    globals().update(histogram=metrics.Histogram('bench_seconds', 'Benchmark histogram', ('route',)),
+                     counter=metrics.Counter('bench_total', 'Benchmark counter', ('route',)))
+    observe_ns = per_call('histogram.labels("next_round").observe(0.003)')
+    inc_ns = per_call('counter.labels("next_round").inc()')
+    with card_app.app.test_request_context('/t/metrics/next_round', method='POST'):
+        hooks_ns = per_call('card_app.start_timer(); card_app.record_request(response)',
+                            setup='response = card_app.app.response_class("")')
+    histograms = sum(isinstance(update, metrics._Buckets) for update in counted)
+    estimate_ns = hooks_ns + (histograms - 1) * observe_ns + (len(counted) - histograms - 1) * inc_ns
+    return {
+        'participants': args.table_size,
+        'updates_per_request': len(counted),
+        'histogram_observe_ns': round(observe_ns, 1),
+        'counter_inc_ns': round(inc_ns, 1),
+        'request_hooks_ns': round(hooks_ns, 1),
+        'instrumentation_us_per_request': round(estimate_ns / 1000, 2),
+        'next_round_us': round(plain * 1e6, 1),
+        'instrumentation_percent': round(estimate_ns / 1000 / (plain * 1e6) * 100, 2),
+        'next_round_instrumented_us': round(instrumented * 1e6, 1),
+        'scrape_bytes': len(card_app.metrics.render())
+    }
+
+def per_call(stmt, setup='pass', number=None):
+    """Best-of-five nanoseconds per run of `stmt`"""
+    timer = timeit.Timer(stmt, setup, globals=globals())
+    if number is None:
+        number = max(1, timer.autorange()[0])
+    return min(timer.repeat(5, number)) / number * 1e9
+
+def bench_micro(args):
+    """Nanoseconds per call of the hot paths, for a table of --table-size participants"""
+    rng = random.Random(0)
+    deck = card_app.Deck(rng)
+    participants = []
+    for i in range(args.table_size):
+        traits = card_app.trait_mask(rng.sample(card_app.TRAITS, i % 3))
+        cards = card_app.draw_for_participant(deck, traits) if deck.cards else b""
+        p = slotted_participant(f'Combatant {i}', card_app.TRAIT_LISTS[traits], cards)
+        p.active_card = card_app.get_active_from_initial(cards, traits) if cards else None
+        p.id = f'p{i}'
+        participants.append(p)
+        if len(deck.cards) < 5:
+            deck = card_app.Deck(rng)
+    hands = [(bytes(rng.sample(range(card_app.Card.COUNT), 3)), rng.choice([0, card_app.QUICK, card_app.LEVEL_HEADED,
+             card_app.IMPROVED_LEVEL_HEADED, card_app.HESITANT])) for _ in range(1000)]
+    globals().update(participants=participants, hands=hands)
+    timings = {
+        'deck_draw_ns': per_call('deck.cards = bytearray(card_app.FULL_DECK)\nfor _ in range(54): deck.draw()',
+                                 'deck = card_app.Deck()') / 54,
+        'serialize_participants_ns': per_call('card_app.serialize_participants(participants)'),
+        'encode_participants_ns': per_call('[p.encode() for p in participants]'),
+        'initiative_sort_ns': per_call('order = participants[::-1]; order.sort(key=card_app.initiative_key, reverse=True)'),
+        'get_active_from_initial_ns': per_call('for cards, traits in hands: card_app.get_active_from_initial(cards, traits)',
+                                               number=200) / len(hands)
+    }
+    return dict({'participants': args.table_size}, **{name: round(ns, 1) for name, ns in timings.items()})
+
+def bench_undo(args):
+    """Memory per undo step on a --table-size table when each step draws one extra
+    card, against a full copy of the participants, and the time to undo"""
+    table = card_app.Table('undo')
+    for i in range(args.table_size):
+        table.add_participant(card_app.Participant(f'Combatant {i}'))
+    card_app.next_round(table, {})
+    table.mark_changed()
+    rng = random.Random(0)
+    steps = table.undo_history.maxlen
+
+    def change():
+        before = table.state
+        card_app.draw_additional(table, {'id': rng.choice(table.participants).id})
+        if not table.deck.cards:
+            # Reshuffle rather than start a round, so each step still changes one participant
+            table.deck = card_app.Deck(table.rng)
+        table.mark_changed()
+        table.remember(before)
+
+    change()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for _ in range(steps):
+        change()
+    after = tracemalloc.take_snapshot()
+    copies = [p.copy() for p in table.participants]
+    copied = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    history = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    full_copy = sum(stat.size_diff for stat in copied.compare_to(after, 'filename'))
+    del copies
+
+    def undo_redo():
+        table.step(True)
+        table.mark_changed()
+        table.step(False)
+        table.mark_changed()
+    seconds = min(timeit.repeat(undo_redo, number=100, repeat=5)) / 200
+    return {
+        'participants': args.table_size,
+        'depth': steps,
+        'bytes_per_step': round(history / steps),
+        'full_copy_bytes': full_copy,
+        'undo_us': round(seconds * 1e6, 1)
+    }
+
+BENCHMARKS = {
+    'journal': bench_journal,
+    'load': bench_load,
+    'memory': bench_memory,
+    'metrics': bench_metrics,
+    'micro': bench_micro,
+    'simulate': bench_simulate,
+    'undo': bench_undo,
+    'wire': bench_wire,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--participants', type=int, default=500)
+    parser.add_argument('--tables', type=int, default=300)
+    parser.add_argument('--roster', type=int, default=10, help='simulated roster size')
+    parser.add_argument('--rounds', type=int, default=1000000, help='simulated rounds')
+    parser.add_argument('--table-size', type=int, default=50, help='participants in the wire, micro and undo benchmarks')
+    parser.add_argument('--session-rounds', type=int, default=20, help='rounds in the wire benchmark')
+    parser.add_argument('--load-tables', type=int, default=10, help='tables driven in the load benchmark')
+    parser.add_argument('--subscribers', type=int, default=200, help='spectator streams in the load benchmark')
+    parser.add_argument('--load-rounds', type=int, default=20, help='rounds each GM runs in the load benchmark')
+    parser.add_argument('--stream-encoding', choices=('gzip', 'identity'), default='gzip',
+                        help='what the load benchmark\'s spectators accept; browsers ask for gzip')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per run in the metrics benchmark')
+    parser.add_argument('--output', help='also write the results, options and platform to this JSON file')
+    args = parser.parse_args()
+    results = BENCHMARKS[args.benchmark](args)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'benchmark': args.benchmark,
+                'options': {key: value for key, value in vars(args).items() if key not in ('benchmark', 'output')},
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'results': results
+            }, f, indent=2)
+
+if __name__ == '__main__':
+    main()
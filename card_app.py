@@ -1,108 +1,840 @@
-from flask import Flask, render_template_string, request, jsonify, session, Response, stream_with_context
-from queue import Queue
+from flask import Flask, Blueprint, request, jsonify, session, redirect, g, Response
+from urllib.parse import urlsplit, urlencode
+import asyncio
 import threading
 import json
+import os
+import atexit
+import gzip
+import hashlib
+import hmac
+import collections
 from functools import wraps
 import random
+import re
 import secrets
-
-app = Flask(__name__)
-app.secret_key = secrets.token_hex(16)
-
-# SSE message queues for broadcasting updates
-message_queues = []
-message_queues_lock = threading.Lock()
+import sys
+import time
+from bisect import bisect_left, bisect_right
+from sse import SSEServer, accepts_gzip
+from journal import Journal
+from backends import MemoryBackend, SQLiteBackend
+from metrics import Registry
+from profiling import SamplingProfiler, RequestProfiler
+
+try:
+    import numpy as np
+except ImportError:  # The simulator falls back to plain Python
+    np = None
+
+# The page and its assets are served from memory (see build_assets), not Flask's static route
+app = Flask(__name__, static_folder=None)
+# Shared by every worker process when set, so GM logins work on all of them
+app.secret_key = os.environ.get('SAVAGEINIT_SECRET_KEY') or secrets.token_hex(16)
 
 # Simple GM password (in production, use proper authentication)
 GM_PASSWORD = "gamemaster"
 
+# Table registry settings
+DEFAULT_TABLE_ID = 'default'
+TABLE_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+TABLE_SHARDS = 16
+MAX_TABLES = 1000
+# Number of recent updates kept per table so reconnecting streams can resume
+DELTA_HISTORY = 64
+# Changes per table that can be undone (0 turns undo off)
+UNDO_DEPTH = 50
+# Seconds to gather mutations into one broadcast (0 broadcasts every mutation)
+COALESCE_WINDOW = 0.03
+# Stream subscribers see one of these views of a table, in one of these formats;
+# see ROLE_VIEWS
+ROLES = ('gm', 'player', 'overlay')
+DEFAULT_ROLE = 'player'
+FORMATS = ('json', 'compact')
+# JSON routes send the compact format to clients that ask for this type
+COMPACT_MIMETYPE = 'application/vnd.savageinit.compact+json'
+
+# Live updates are served by an event loop on their own port; /stream redirects there
+SSE_HOST = '0.0.0.0'
+SSE_PORT = 5001
+# Where browsers reach that port, e.g. https://live.example.com behind a TLS proxy;
+# unset redirects to SSE_PORT on the host and scheme the page was loaded from
+SSE_URL = (os.environ.get('SAVAGEINIT_SSE_URL') or '').rstrip('/') or None
+# Per-subscriber buffer depth, and how long a stuck client may block before it is dropped
+SSE_QUEUE_DEPTH = 32
+SSE_STALL_TIMEOUT = 30
+# State responses at least this large are gzipped for clients that accept it
+GZIP_MIN_SIZE = 1024
+
+# SQLite database shared by every worker process when running several of them
+# (e.g. under gunicorn); unset keeps tables in this process's memory
+STATE_DB = os.environ.get('SAVAGEINIT_STATE_DB')
+
+# The page, script and stylesheet, loaded once at startup
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+# Table state is journaled here so it survives restarts (None keeps it in memory only)
+JOURNAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Profiles started from /profile are written here, within these limits
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles')
+MAX_PROFILE_SECONDS = 300
+MAX_PROFILE_REQUESTS = 1000
+
+# Monte Carlo simulator limits; rounds are simulated this many at a time
+MAX_SIMULATION_ROUNDS = 5000000
+# Without NumPy a million rounds takes about a minute, so requests are kept far shorter
+MAX_SIMULATION_ROUNDS_PYTHON = 100000
+SIMULATION_CHUNK = 65536
+
+# Served in Prometheus text format at /metrics; stream metrics are added once the
+# SSE server exists
+metrics = Registry()
+HTTP_REQUESTS = metrics.counter('savageinit_http_requests_total', 'HTTP requests by route, method and status',
+                                ('route', 'method', 'status'))
+HTTP_SECONDS = metrics.histogram('savageinit_http_request_duration_seconds', 'Time spent handling HTTP requests',
+                                 ('route',))
+BROADCAST_SECONDS = metrics.histogram('savageinit_broadcast_seconds',
+                                      'Time to build and publish every watched view after a change')
+BROADCAST_SERIALIZE_SECONDS = metrics.histogram('savageinit_broadcast_serialize_seconds',
+                                                "Time to serialize a view's participants for a broadcast",
+                                                ('role', 'format'))
+BROADCAST_ENCODE_SECONDS = metrics.histogram('savageinit_broadcast_encode_seconds',
+                                             'Time to diff and encode a broadcast frame', ('role', 'format'))
+BROADCASTS = metrics.counter('savageinit_broadcasts_total', 'Frames published to stream subscribers',
+                             ('role', 'format'))
+
+@app.before_request
+def start_timer():
+    request.environ['savageinit.start'] = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    # Each access through the `request` proxy costs about a microsecond, so resolve it once
+    req = request._get_current_object()
+    start = req.environ.get('savageinit.start')
+    if start is not None:
+        # Both mounts of the table routes count as one route
+        route = req.endpoint.rpartition('.')[2] if req.endpoint else 'unmatched'
+        HTTP_SECONDS.labels(route).observe(time.perf_counter() - start)
+        HTTP_REQUESTS.labels(route, req.method, str(response.status_code)).inc()
+    return response
+
 class Card:
+    """Cards are small integers (codes) indexing the immutable CARDS table.
+
+    Codes 0-51 run through the suits in SUITS order, ranks 2 to A; 52 and 53 are
+    the two Jokers.  Everything about a card is precomputed once, so decks and
+    participants only ever hold ints.
+    """
     SUITS = ['Spades', 'Hearts', 'Diamonds', 'Clubs']
     RANKS = ['2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K', 'A']
-    
-    def __init__(self, suit, rank):
+    FIRST_JOKER = 52
+    COUNT = 54
+
+    __slots__ = ('code', 'rank', 'suit', 'display', 'value', 'suit_value', 'sort_key', 'json', 'dict')
+
+    def __init__(self, code, suit, rank):
+        self.code = code
         self.suit = suit
         self.rank = rank
-        
-    def value(self):
-        """Return numeric value for sorting"""
-        if self.rank == 'Joker':
-            return 15
-        elif self.rank == 'A':
-            return 14
-        elif self.rank == 'K':
-            return 13
-        elif self.rank == 'Q':
-            return 12
-        elif self.rank == 'J':
-            return 11
+        if rank == 'Joker':
+            self.display = "Joker"
+            self.value = 15
+            self.suit_value = 4
         else:
-            return int(self.rank)
-    
-    def suit_value(self):
-        """Return suit value for sorting (Spades > Hearts > Diamonds > Clubs)"""
-        if self.rank == 'Joker':
-            return 4
-        suit_order = {'Spades': 3, 'Hearts': 2, 'Diamonds': 1, 'Clubs': 0}
-        return suit_order.get(self.suit, -1)
-    
-    def __repr__(self):
-        if self.rank == 'Joker':
-            return "Joker"
-        return f"{self.rank} of {self.suit}"
-    
-    def to_dict(self):
-        return {
+            self.display = f"{rank} of {suit}"
+            self.value = {'A': 14, 'K': 13, 'Q': 12, 'J': 11}.get(rank) or int(rank)
+            # Spades > Hearts > Diamonds > Clubs
+            self.suit_value = 3 - Card.SUITS.index(suit)
+        # Orders exactly like the (value, suit_value) tuple
+        self.sort_key = self.value * 5 + self.suit_value
+        self.dict = {
             'rank': self.rank,
             'suit': self.suit,
-            'display': str(self),
-            'value': self.value(),
-            'suit_value': self.suit_value()
+            'display': self.display,
+            'value': self.value,
+            'suit_value': self.suit_value
         }
+        self.json = json.dumps(self.dict)
+
+    def __repr__(self):
+        return self.display
+
+CARDS = tuple(
+    [Card(i * len(Card.RANKS) + j, suit, rank) for i, suit in enumerate(Card.SUITS) for j, rank in enumerate(Card.RANKS)]
+    + [Card(Card.FIRST_JOKER, '', 'Joker'), Card(Card.FIRST_JOKER + 1, '', 'Joker')]
+)
+SORT_KEY = tuple(c.sort_key for c in CARDS)
+CARD_JSON = tuple(c.json for c in CARDS)
+CARD_DISPLAY_JSON = tuple(json.dumps(c.display) for c in CARDS)
+CARD_CODE = tuple(str(c.code) for c in CARDS)
+FULL_DECK = bytes(range(Card.COUNT))
+
+def is_joker(card):
+    return card >= Card.FIRST_JOKER
 
 class Deck:
-    def __init__(self):
-        self.cards = []
-        for suit in Card.SUITS:
-            for rank in Card.RANKS:
-                self.cards.append(Card(suit, rank))
-        self.cards.append(Card('', 'Joker'))
-        self.cards.append(Card('', 'Joker'))
-        self.shuffle()
+    def __init__(self, rng=random):
+        self.cards = bytearray(FULL_DECK)
+        self.shuffle(rng)
     
-    def shuffle(self):
-        random.shuffle(self.cards)
+    def shuffle(self, rng=random):
+        rng.shuffle(self.cards)
     
     def draw(self, n=1):
         drawn = []
         for _ in range(min(n, len(self.cards))):
-            if len(self.cards) == 0:
-                break
             drawn.append(self.cards.pop())
         return drawn
-    
+
+# Traits are stored as a bitmask; everything derived from a mask is precomputed
+TRAIT_NAMES = {
+    'level_headed': 'Level Headed',
+    'improved_level_headed': 'Improved Level Headed',
+    'quick': 'Quick',
+    'hesitant': 'Hesitant'
+}
+TRAITS = tuple(TRAIT_NAMES)
+LEVEL_HEADED, IMPROVED_LEVEL_HEADED, QUICK, HESITANT = (1 << i for i in range(len(TRAITS)))
+TRAIT_LISTS = tuple([t for i, t in enumerate(TRAITS) if mask & (1 << i)] for mask in range(1 << len(TRAITS)))
+TRAIT_JSON = tuple(json.dumps(traits) for traits in TRAIT_LISTS)
+TRAIT_DISPLAY = tuple(', '.join([TRAIT_NAMES[t] for t in traits]) for traits in TRAIT_LISTS)
+TRAIT_DISPLAY_JSON = tuple(json.dumps(display) for display in TRAIT_DISPLAY)
+
+def trait_mask(traits):
+    """Bitmask for a list of trait names (unknown names, and anything but a list, are ignored)"""
+    mask = 0
+    if not isinstance(traits, list):
+        return mask
+    for t in traits:
+        if isinstance(t, str) and t in TRAIT_NAMES:
+            mask |= 1 << TRAITS.index(t)
+    return mask
+
+class Participant:
+    """One combatant.  Cards are stored as a bytes array of card codes, with any
+    additional cards (from Draw Additional) as the last `extra` entries."""
+    __slots__ = ('id', 'name', 'traits', 'cards', 'extra', 'active_card', 'has_drawn')
+
+    def __init__(self, name, traits=0, cards=b"", has_drawn=False):
+        # Stable opaque ID, assigned when the participant joins a table
+        self.id = None
+        self.name = name
+        self.traits = traits
+        self.cards = bytes(cards)
+        self.extra = 0
+        self.active_card = None
+        self.has_drawn = has_drawn
+
+    @property
+    def additional_cards(self):
+        return self.cards[len(self.cards) - self.extra:]
+
+    @property
+    def initiative_key(self):
+        """Sort key for initiative order (higher goes first, no card sorts last)"""
+        return SORT_KEY[self.active_card] if self.active_card is not None else -1
+
+    def copy(self):
+        twin = Participant(self.name, self.traits, self.cards, self.has_drawn)
+        twin.id = self.id
+        twin.extra = self.extra
+        twin.active_card = self.active_card
+        return twin
+
+    def frozen(self, previous):
+        """An unchanging copy of this participant for a TableState: `previous` (its copy in
+        the last state) if nothing has changed since, so unchanged participants are shared"""
+        if (previous is not None and previous.cards == self.cards and previous.active_card == self.active_card
+                and previous.name == self.name and previous.traits == self.traits
+                and previous.extra == self.extra and previous.has_drawn == self.has_drawn):
+            return previous
+        return self.copy()
+
+    def clear_cards(self):
+        self.cards = b""
+        self.extra = 0
+        self.active_card = None
+
+    def to_dict(self):
+        active = self.active_card
+        return {
+            'id': self.id,
+            'name': self.name,
+            'traits': TRAIT_LISTS[self.traits],
+            'trait_display': get_traits_display(self.traits),
+            'has_drawn': self.has_drawn,
+            'cards': [CARDS[c].dict for c in self.cards],
+            'additional_cards': [CARDS[c].dict for c in self.additional_cards],
+            'active_card': CARDS[active].dict if active is not None else None
+        }
+
+    def encode(self):
+        """JSON for this participant, spliced together from the pre-encoded fragments"""
+        active = self.active_card
+        return '{"id": "%s", "name": %s, "traits": %s, "trait_display": %s, "has_drawn": %s, "cards": [%s], "additional_cards": [%s], "active_card": %s}' % (
+            self.id,
+            json.dumps(self.name),
+            TRAIT_JSON[self.traits],
+            TRAIT_DISPLAY_JSON[self.traits],
+            'true' if self.has_drawn else 'false',
+            ', '.join([CARD_JSON[c] for c in self.cards]),
+            ', '.join([CARD_JSON[c] for c in self.additional_cards]),
+            CARD_JSON[active] if active is not None else 'null'
+        )
+
+    def encode_player(self):
+        """JSON for the player view: what the initiative list shows, without the GM's details"""
+        active = self.active_card
+        return '{"id": "%s", "name": %s, "trait_display": %s, "cards": [%s], "active_card": %s}' % (
+            self.id,
+            json.dumps(self.name),
+            TRAIT_DISPLAY_JSON[self.traits],
+            ', '.join([CARD_JSON[c] for c in self.cards]),
+            CARD_JSON[active] if active is not None else 'null'
+        )
+
+    def encode_overlay(self):
+        """JSON for the overlay view: just the name and the active card"""
+        return '{"id": "%s", "name": %s, "card": %s}' % (
+            self.id, json.dumps(self.name), CARD_DISPLAY_JSON[self.active_card]
+        )
+
+    # The compact format sends each participant as a positional array, with cards as
+    # their codes and traits as their mask; clients derive everything else
+
+    def encode_compact(self):
+        """[id, name, traits, has_drawn, [cards], extra, active_card]"""
+        active = self.active_card
+        return '["%s",%s,%d,%d,[%s],%d,%s]' % (
+            self.id, json.dumps(self.name), self.traits, self.has_drawn,
+            ','.join([CARD_CODE[c] for c in self.cards]), self.extra,
+            CARD_CODE[active] if active is not None else 'null'
+        )
+
+    def encode_player_compact(self):
+        """[id, name, traits, [cards], active_card]"""
+        active = self.active_card
+        return '["%s",%s,%d,[%s],%s]' % (
+            self.id, json.dumps(self.name), self.traits,
+            ','.join([CARD_CODE[c] for c in self.cards]),
+            CARD_CODE[active] if active is not None else 'null'
+        )
+
+    def encode_overlay_compact(self):
+        """[id, name, active_card]"""
+        return '["%s",%s,%s]' % (self.id, json.dumps(self.name), CARD_CODE[self.active_card])
+
+def initiative_key(p):
+    return p.initiative_key
+
+def descending_key(p):
+    return -p.initiative_key
+
+def locate(participants, p):
+    """Index of `p` in a list kept in initiative order, found by binary search on its key"""
+    key = -p.initiative_key
+    lo = bisect_left(participants, key, key=descending_key)
+    hi = bisect_right(participants, key, lo, key=descending_key)
+    return participants.index(p, lo, hi)
+
+def reposition(participants, index):
+    """Move the participant at `index`, whose active card just changed, to the place a
+    full stable re-sort would put it.  The rest of the list is already in initiative
+    order, so this is a binary search instead of a sort."""
+    p = participants.pop(index)
+    key = -p.initiative_key
+    lo = bisect_left(participants, key, key=descending_key)
+    hi = bisect_right(participants, key, lo, key=descending_key)
+    # A stable sort keeps ties in their previous order, so among participants with the
+    # same card (no card, or Jokers) it stays where it was
+    participants.insert(min(max(index, lo), hi), p)
+
 def serialize_participants(participants):
-    serialized = []
-    for p in participants:
-        serialized.append({
-            'name': p['name'],
-            'traits': p.get('traits', []),
-            'trait_display': p.get('trait_display'),
-            'has_drawn': p.get('has_drawn'),
-            'cards': [c if isinstance(c, dict) else c.to_dict() for c in p.get('cards', [])],
-            'additional_cards': [c if isinstance(c, dict) else c.to_dict() for c in p.get('additional_cards', [])],        
-            'active_card': (
-                p['active_card'] if isinstance(p.get('active_card'), dict)
-                else p.get('active_card').to_dict() if p.get('active_card')
-                else None
-            )
-        })
-    return serialized
-
-# Global state
-deck = Deck()
-participants = []
-joker_drawn = False
+    return [p.to_dict() for p in participants]
+
+def sse_frame(version, payload):
+    return b"id: %d\ndata: %s\n\n" % (version, payload)
+
+def diff_participants(old, new):
+    """Describe the change between two lists of (id, encoded participant)"""
+    old_by_id = dict(old)
+    new_by_id = dict(new)
+    delta = {
+        'upsert': [encoded for pid, encoded in new if old_by_id.get(pid) != encoded],
+        'remove': [pid for pid in old_by_id if pid not in new_by_id]
+    }
+    order = [pid for pid, _ in new]
+    if order != [pid for pid, _ in old]:
+        delta['order'] = order
+    return delta
+
+def dealt_in(p):
+    return bool(p.cards)
+
+def has_active_card(p):
+    return p.active_card is not None
+
+# (role, format) -> (participant encoder, which participants the role sees).  Players
+# only see who has been dealt in; the overlay only needs names and active cards.
+ROLE_VIEWS = {
+    ('gm', 'json'): (Participant.encode, None),
+    ('gm', 'compact'): (Participant.encode_compact, None),
+    ('player', 'json'): (Participant.encode_player, dealt_in),
+    ('player', 'compact'): (Participant.encode_player_compact, dealt_in),
+    ('overlay', 'json'): (Participant.encode_overlay, has_active_card),
+    ('overlay', 'compact'): (Participant.encode_overlay_compact, has_active_card),
+}
+
+class TableState:
+    """An immutable copy of a table as of one version, published after every change.
+
+    Commands mutate the table's working state under its lock; readers use the last
+    published TableState and never wait for them.  Participants that did not change
+    are shared with the previous state rather than copied.  Each view's encoding is
+    cached on the state, so it is built at most once per version.
+    """
+    __slots__ = ('version', 'participants', 'deck', 'joker_drawn', 'encoded')
+
+    def __init__(self, table, previous=None):
+        shared = {p.id: p for p in previous.participants} if previous is not None else {}
+        self.version = table.version
+        self.participants = tuple([p.frozen(shared.get(p.id)) for p in table.participants])
+        self.deck = bytes(table.deck.cards)
+        self.joker_drawn = table.joker_drawn
+        self.encoded = {}
+
+    def encode(self, role, format):
+        """(serialized participants, snapshot body, SSE frame) for one view of this state"""
+        encoded = self.encoded.get((role, format))
+        if encoded is None:
+            encode, visible = ROLE_VIEWS[role, format]
+            serialized = [(p.id, encode(p)) for p in self.participants if visible is None or visible(p)]
+            body = ('{"type": "snapshot", "version": %d, "participants": [%s], "deck_remaining": %d}' % (
+                self.version, ', '.join([encoded for _, encoded in serialized]), len(self.deck)
+            )).encode()
+            # Readers may race to fill the cache; they build the same thing
+            encoded = self.encoded[role, format] = (serialized, body, sse_frame(self.version, body))
+        return encoded
+
+    def gzip(self, role, format):
+        """The snapshot body gzipped, compressed at most once per version"""
+        compressed = self.encoded.get(('gzip', role, format))
+        if compressed is None:
+            compressed = self.encoded['gzip', role, format] = gzip.compress(self.encode(role, format)[1], mtime=0)
+        return compressed
+
+class View:
+    """One role's stream of a table in one format: what its subscribers were last sent
+    and the recent deltas for resuming.
+
+    A view only starts publishing once it has had a subscriber, so views nobody
+    watches cost nothing.  Call with the table locked.
+    """
+    __slots__ = ('role', 'format', 'active', 'published', 'deltas')
+
+    def __init__(self, role, format):
+        self.role = role
+        self.format = format
+        self.active = False
+        # The TableState last sent to subscribers
+        self.published = None
+        # Recent (base_version, version, frame) updates for resuming streams
+        self.deltas = None
+
+    def snapshot_frame(self):
+        """A full frame of the published state.  Newer changes may still be waiting to be
+        broadcast; a snapshot of them would not chain with the delta that carries them."""
+        return self.published.encode(self.role, self.format)[2]
+
+    def activate(self, table):
+        """Start publishing, with the current state as the baseline"""
+        self.active = True
+        self.published = table.state
+        self.deltas = collections.deque(maxlen=DELTA_HISTORY)
+
+    def publish(self, table):
+        state = table.state
+        base = self.published.version
+        if base == state.version:
+            return None
+        start = time.perf_counter()
+        serialized, snapshot, frame = state.encode(self.role, self.format)
+        encoded_at = time.perf_counter()
+        delta = diff_participants(self.published.encode(self.role, self.format)[0], serialized)
+        encoded = ('{"type": "delta", "base": %d, "version": %d, "upsert": [%s], "remove": %s, %s"deck_remaining": %d}' % (
+            base, state.version, ', '.join(delta['upsert']), json.dumps(delta['remove']),
+            '"order": %s, ' % json.dumps(delta['order']) if 'order' in delta else '',
+            len(state.deck)
+        )).encode()
+        # A delta that touches everyone is no cheaper than the snapshot
+        if len(encoded) < len(snapshot):
+            frame = sse_frame(state.version, encoded)
+        BROADCAST_SERIALIZE_SECONDS.labels(self.role, self.format).observe(encoded_at - start)
+        BROADCAST_ENCODE_SECONDS.labels(self.role, self.format).observe(time.perf_counter() - encoded_at)
+        self.published = state
+        self.deltas.append((base, state.version, frame))
+        return frame
+
+    def start_frame(self, last_version):
+        """Frames a new subscriber starts with: everything after `last_version` if it has
+        seen one, otherwise a full snapshot.  Needs no lock, so the SSE loop can build it
+        in the same step that registers the subscriber; a broadcast it raced with is
+        delivered again and skipped by the client as already applied."""
+        published = self.published
+        if last_version is None:
+            return published.encode(self.role, self.format)[2]
+        if last_version == published.version:
+            # Anything newer is still being coalesced and will be broadcast shortly
+            return b""
+        frames = []
+        # Copied because a publish in another thread may append meanwhile
+        for base, version, frame in list(self.deltas):
+            if frames or base == last_version:
+                frames.append(frame)
+        if frames:
+            return b"".join(frames)
+        # Too far behind (or unknown version): start over from a full snapshot
+        return published.encode(self.role, self.format)[2]
+
+class Table:
+    """All state for one game: its own deck, participants and joker flag"""
+    __slots__ = ('table_id', 'deck', 'participants', 'by_id', 'by_name', 'joker_drawn', 'lock',
+                 'version', 'state', 'undo_history', 'redo_history', 'views', 'flush_pending', 'rng', 'journal_seq', '_next_id', '_name_counters')
+
+    def __init__(self, table_id, version=0):
+        self.table_id = table_id
+        # Every shuffle for this table comes from its own generator, so a journaled
+        # command replays to the same deck when it is re-run with the same seed
+        self.rng = random.Random()
+        # Sequence number of the last journal entry applied to this table
+        self.journal_seq = 0
+        self.deck = Deck(self.rng)
+        # Participants in initiative order, plus indexes by stable ID and by (unique) name
+        self.participants = []
+        self.by_id = {}
+        self.by_name = {}
+        self._next_id = 0
+        # Next suffix to try for each base name, so "Goblin N" is found without rescanning
+        self._name_counters = {}
+        self.joker_drawn = False
+        # Per-table lock so tables never contend with each other
+        self.lock = threading.RLock()
+        # Bumped on every mutation, which also publishes a new TableState for readers
+        self.version = version
+        self.state = TableState(self)
+        # Earlier and undone states, newest last, as (participants, deck, joker_drawn).
+        # They share unchanged participants with each other and with the current state.
+        self.undo_history = collections.deque(maxlen=UNDO_DEPTH)
+        self.redo_history = collections.deque(maxlen=UNDO_DEPTH)
+        # (role, format) -> View, created when first asked for
+        self.views = {}
+        # True while a coalesced broadcast is scheduled
+        self.flush_pending = False
+
+    def unique_name(self, name):
+        """`name`, or `name N` with the first free N if it is already taken"""
+        if name not in self.by_name:
+            return name
+        counter = self._name_counters.get(name, 1)
+        while f"{name} {counter}" in self.by_name:
+            counter += 1
+        self._name_counters[name] = counter + 1
+        return f"{name} {counter}"
+
+    def add_participant(self, p):
+        """Give `p` an ID and a unique name, and add it at the end of the list"""
+        self._next_id += 1
+        p.id = f"p{self._next_id}"
+        p.name = self.unique_name(p.name)
+        self.by_id[p.id] = p
+        self.by_name[p.name] = p
+        self.participants.append(p)
+        return p
+
+    def remove_participant(self, p):
+        self.participants.pop(locate(self.participants, p))
+        del self.by_id[p.id]
+        del self.by_name[p.name]
+
+    def rename_participant(self, p, name):
+        del self.by_name[p.name]
+        p.name = name
+        self.by_name[name] = p
+
+    def clear_participants(self):
+        self.participants = []
+        self.by_id = {}
+        self.by_name = {}
+        self._name_counters = {}
+
+    def find_participant(self, data):
+        """The participant a request addresses: by stable `id`, or by list `index` for older clients"""
+        if 'id' in data:
+            # Anything but a string (a list, say) is no one's ID and cannot be looked up
+            return self.by_id.get(data['id']) if isinstance(data['id'], str) else None
+        index = data.get('index')
+        if isinstance(index, int) and 0 <= index < len(self.participants):
+            return self.participants[index]
+        return None
+
+    def checkpoint(self):
+        """Capture the game state so a failed command or batch can be rolled back"""
+        return (self.deck, bytes(self.deck.cards), [p.copy() for p in self.participants],
+                self.joker_drawn, self._next_id, dict(self._name_counters))
+
+    def rollback(self, state):
+        deck, cards, participants, joker_drawn, next_id, name_counters = state
+        deck.cards = bytearray(cards)
+        self.deck = deck
+        self.participants = participants
+        self.by_id = {p.id: p for p in participants}
+        self.by_name = {p.name: p for p in participants}
+        self.joker_drawn = joker_drawn
+        self._next_id = next_id
+        self._name_counters = name_counters
+
+    def remember(self, before):
+        """Record `before`, the state ahead of a command, as the next undo step unless the
+        command left the table as it was"""
+        state = self.state
+        # Unchanged participants are shared, so comparing identities is enough
+        if (before.deck == state.deck and before.joker_drawn == state.joker_drawn
+                and len(before.participants) == len(state.participants)
+                and all(a is b for a, b in zip(before.participants, state.participants))):
+            return
+        self.undo_history.append((before.participants, before.deck, before.joker_drawn))
+        self.redo_history.clear()
+
+    def step(self, back):
+        """Go back to the state before the last change (or forward again to the last
+        undone one); False if there is nowhere to go"""
+        source, dest = (self.undo_history, self.redo_history) if back else (self.redo_history, self.undo_history)
+        if not source:
+            return False
+        state = self.state
+        dest.append((state.participants, state.deck, state.joker_drawn))
+        participants, deck, joker_drawn = source.pop()
+        self.deck.cards = bytearray(deck)
+        self.participants = [p.copy() for p in participants]
+        self.by_id = {p.id: p for p in self.participants}
+        self.by_name = {p.name: p for p in self.participants}
+        self.joker_drawn = joker_drawn
+        return True
+
+    def dump_state(self):
+        """Game state as plain JSON data, for journal snapshots"""
+        with self.lock:
+            return {
+                'deck': self.deck.cards.hex(),
+                'participants': [[p.id, p.name, p.traits, p.cards.hex(), p.extra, p.active_card, p.has_drawn]
+                                 for p in self.participants],
+                'joker_drawn': self.joker_drawn,
+                'next_id': self._next_id,
+                'name_counters': self._name_counters,
+                'version': self.version,
+                'journal_seq': self.journal_seq
+            }
+
+    def load_state(self, state, version=None):
+        """Restore a dump_state() result, at `version` if given; None empties the table"""
+        # History from before the reload may not lead to it
+        self.undo_history.clear()
+        self.redo_history.clear()
+        if state is None:
+            self.deck = Deck(self.rng)
+            self.clear_participants()
+            self.joker_drawn = False
+            self._next_id = 0
+            if version is not None:
+                self.version = version
+            self.state = TableState(self)
+            return
+        self.deck.cards = bytearray.fromhex(state['deck'])
+        participants = []
+        for pid, name, traits, cards, extra, active_card, has_drawn in state['participants']:
+            p = Participant(name, traits, bytes.fromhex(cards), has_drawn)
+            p.id = pid
+            p.extra = extra
+            p.active_card = active_card
+            participants.append(p)
+        self.participants = participants
+        self.by_id = {p.id: p for p in participants}
+        self.by_name = {p.name: p for p in participants}
+        self.joker_drawn = state['joker_drawn']
+        self._next_id = state['next_id']
+        self._name_counters = state['name_counters']
+        self.version = state['version'] if version is None else version
+        self.journal_seq = state['journal_seq']
+        self.state = TableState(self)
+
+    def mark_changed(self):
+        with self.lock:
+            self.version += 1
+            self.state = TableState(self, self.state)
+
+    def view(self, role, format='json'):
+        """The View for a role and format (call with the table locked)"""
+        view = self.views.get((role, format))
+        if view is None:
+            view = self.views[role, format] = View(role, format)
+        return view
+
+    def snapshot_frame(self, role='gm', format='json'):
+        """The latest full frame for a view's subscribers: what was last broadcast to
+        them, or the current state if the view has none yet"""
+        view = self.views.get((role, format))
+        if view is not None and view.active:
+            return view.snapshot_frame()
+        return self.state.encode(role, format)[2]
+
+    def publish(self):
+        """Return ((role, format), frame) for every watched view, each frame moving that
+        view's subscribers from the last published version to the current one"""
+        with self.lock:
+            self.flush_pending = False
+            frames = []
+            for key, view in self.views.items():
+                frame = view.publish(self) if view.active else None
+                if frame:
+                    frames.append((key, frame))
+            return frames
+
+    def watch(self, role, format='json'):
+        """The view for a role and format, publishing from now on"""
+        with self.lock:
+            view = self.view(role, format)
+            if not view.active:
+                view.activate(self)
+            return view
+
+    def subscribe(self, role, format='json', last_version=None):
+        """Frames a new subscriber of a view starts with (see View.start_frame)"""
+        return self.watch(role, format).start_frame(last_version)
+
+    def memory_usage(self):
+        """Approximate number of bytes held by this table's state.  Called without the
+        lock, so it walks copies of the dicts and deques other threads may be filling."""
+        total = sys.getsizeof(self) + sys.getsizeof(self.table_id)
+        total += sys.getsizeof(self.deck) + sys.getsizeof(self.deck.cards)
+        total += sys.getsizeof(self.participants) + sys.getsizeof(self.by_id) + sys.getsizeof(self.by_name)
+        for view in list(self.views.values()):
+            total += sys.getsizeof(view)
+            deltas = view.deltas
+            if deltas is not None:
+                total += sys.getsizeof(deltas) + sum(sys.getsizeof(d[2]) for d in list(deltas))
+        state = self.state
+        total += sys.getsizeof(state) + sys.getsizeof(state.participants) + sys.getsizeof(state.deck)
+        for encoded in list(state.encoded.values()):
+            total += sum(map(sys.getsizeof, encoded)) if isinstance(encoded, tuple) else sys.getsizeof(encoded)
+        for p in list(self.participants) + list(state.participants):
+            total += sys.getsizeof(p) + sys.getsizeof(p.cards)
+        return total
+
+class TableRegistry:
+    """Tables keyed by ID, split across shards so creating tables never takes a global lock"""
+
+    def __init__(self, shards=TABLE_SHARDS, max_tables=MAX_TABLES):
+        self._shards = [{} for _ in range(shards)]
+        self._locks = [threading.Lock() for _ in range(shards)]
+        self.max_tables = max_tables
+        # Where each closed table's versions left off, so a new table with its ID
+        # carries on from there and clients never mistake its frames for old ones
+        self._closed_versions = {}
+
+    def _shard_index(self, table_id):
+        return hash(table_id) % len(self._shards)
+
+    def get(self, table_id):
+        return self._shards[self._shard_index(table_id)].get(table_id)
+
+    def get_or_create(self, table_id):
+        """Return the table with this ID, creating it if needed (None if the registry is full)"""
+        i = self._shard_index(table_id)
+        table = self._shards[i].get(table_id)
+        if table is not None:
+            return table
+        with self._locks[i]:
+            table = self._shards[i].get(table_id)
+            if table is None:
+                if len(self) >= self.max_tables:
+                    return None
+                table = Table(table_id, self._closed_versions.pop(table_id, 0))
+                self._shards[i][table_id] = table
+            return table
+
+    def remove(self, table_id):
+        """Drop a table (call with the table locked, so its version is final)"""
+        i = self._shard_index(table_id)
+        with self._locks[i]:
+            table = self._shards[i].pop(table_id, None)
+            if table is not None:
+                self._closed_versions[table_id] = table.version + 1
+            return table
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
+
+    def __iter__(self):
+        for shard in self._shards:
+            yield from list(shard.values())
+
+tables = TableRegistry()
+# The default table is always there, so the front page works before the GM does anything
+tables.get_or_create(DEFAULT_TABLE_ID)
+
+# All routes live on this blueprint, which is mounted twice: once at the root for the
+# default table, and once under /t/<table_id> for every other table.
+table_routes = Blueprint('table', __name__)
+
+@table_routes.url_value_preprocessor
+def pull_table_id(endpoint, values):
+    g.table_id = (values or {}).pop('table_id', DEFAULT_TABLE_ID)
+
+def find_table(table_id, create=False):
+    """The table with this ID, or None if it does not exist (or the ID is invalid).
+
+    Only GM changes create tables; anyone can read, and reads must not fill the
+    registry.  With a shared backend a table another process created is loaded.
+    """
+    if not TABLE_ID_PATTERN.match(table_id):
+        return None
+    table = tables.get(table_id)
+    if table is None and (create or backend.has_table(table_id)):
+        table = tables.get_or_create(table_id)
+    return table
+
+def current_table(create=False):
+    """Look up (or, for GM changes, create) the table addressed by the current request"""
+    return find_table(g.get('table_id', DEFAULT_TABLE_ID), create)
+
+def table_required(f):
+    """For GM changes: the table, created if needed, locked and up to date"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        table = current_table(create=True)
+        if table is None:
+            return jsonify({'error': 'Unknown table or too many tables'}), 404
+        with table.lock:
+            backend.refresh(table)
+            return f(table, *args, **kwargs)
+    return decorated_function
+
+def table_state_required(f):
+    """Like table_required for routes that only read: they get the table's published
+    TableState and never wait for a command to finish"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        table = current_table()
+        if table is None:
+            return jsonify({'error': 'Unknown table or too many tables'}), 404
+        if backend.shared:
+            # Another process may have stored a newer version
+            with table.lock:
+                backend.refresh(table)
+        return f(table.state, *args, **kwargs)
+    return decorated_function
 
 def gm_required(f):
     @wraps(f)
@@ -112,903 +844,453 @@ def gm_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def broadcast_update():
-    """Broadcast state update to all connected clients"""
-    data = {
-        'participants': serialize_participants(participants),
-        'deck_remaining': len(deck.cards)
-    }
-    message = f"data: {json.dumps(data)}\n\n"
-
-    with message_queues_lock:
-        dead_queues = []
-        for q in message_queues:
-            try:
-                q.put_nowait(message)
-            except:
-                dead_queues.append(q)
-        for q in dead_queues:
-            message_queues.remove(q)
-
-HTML_TEMPLATE = '''
-<!DOCTYPE html>
-<html>
-<head>
-    <title>Savage Worlds Initiative Tracker</title>
-    <style>
-        body {
-            font-family: Arial, sans-serif;
-            max-width: 1400px;
-            margin: 0 auto;
-            padding: 20px;
-            background-color: #ffffff;
-            color: #000000;
-        }
-        h1 {
-            text-align: center;
-            margin-bottom: 10px;
-        }
-        .subtitle {
-            text-align: center;
-            font-style: italic;
-            margin-bottom: 30px;
-        }
-        .gm-section {
-            border: 2px solid #000;
-            padding: 15px;
-            margin-bottom: 20px;
-        }
-        .gm-controls {
-            display: flex;
-            gap: 10px;
-            margin-top: 10px;
-            flex-wrap: wrap;
-        }
-        .participant-setup {
-            border: 2px solid #000;
-            padding: 15px;
-            margin-bottom: 20px;
-        }
-        .participant-row {
-            display: flex;
-            gap: 10px;
-            margin-bottom: 10px;
-            align-items: center;
-            flex-wrap: wrap;
-        }
-        .participant-row input[type="text"] {
-            flex: 0 0 200px;
-            padding: 5px;
-            border: 1px solid #000;
-        }
-        .trait-buttons {
-            display: flex;
-            gap: 5px;
-            flex-wrap: wrap;
-        }
-        .trait-button {
-            padding: 5px 10px;
-            border: 2px solid #000;
-            background-color: #ffffff;
-            cursor: pointer;
-            font-size: 12px;
-        }
-        .trait-button.selected {
-            background-color: #000;
-            color: #fff;
-        }
-        .trait-button:disabled {
-            opacity: 0.3;
-            cursor: not-allowed;
-        }
-        .participant-row button {
-            padding: 5px 10px;
-        }
-        button {
-            background-color: #ffffff;
-            color: #000000;
-            padding: 8px 15px;
-            border: 2px solid #000;
-            cursor: pointer;
-            font-size: 14px;
-        }
-        button:hover {
-            background-color: #f0f0f0;
-        }
-        button:disabled {
-            opacity: 0.5;
-            cursor: not-allowed;
-        }
-        .initiative-tracker {
-            border: 2px solid #000;
-            padding: 15px;
-        }
-        .initiative-row {
-            display: flex;
-            gap: 15px;
-            padding: 10px;
-            margin-bottom: 5px;
-            border-bottom: 1px solid #ccc;
-            align-items: center;
-        }
-        .initiative-row:last-child {
-            border-bottom: none;
-        }
-        .rank {
-            font-weight: bold;
-            min-width: 30px;
-        }
-        .participant-name {
-            min-width: 150px;
-            font-weight: bold;
-        }
-        .cards {
-            display: flex;
-            gap: 10px;
-            flex-wrap: wrap;
-        }
-        .card {
-            border: 1px solid #000;
-            padding: 8px 12px;
-            min-width: 60px;
-            text-align: center;
-            background-color: #ffffff;
-        }
-        .card.active {
-            border: 3px solid #000;
-            font-weight: bold;
-        }
-        .card.spades::before {
-            content: "♠ ";
-        }
-        .card.hearts::before {
-            content: "♥ ";
-            color: red;
-        }
-        .card.diamonds::before {
-            content: "♦ ";
-            color: red;
-        }
-        .card.clubs::before {
-            content: "♣ ";
-        }
-        .card.hearts, .card.diamonds {
-            color: red;
-        }
-        .card.joker {
-            font-weight: bold;
-            text-decoration: underline;
-        }
-        .edge-hindrance {
-            font-size: 12px;
-            font-style: italic;
-            color: #666;
-        }
-        .login-form {
-            max-width: 300px;
-            margin: 50px auto;
-            border: 2px solid #000;
-            padding: 20px;
-        }
-        .login-form input {
-            width: 100%;
-            padding: 8px;
-            margin-bottom: 10px;
-            border: 1px solid #000;
-            box-sizing: border-box;
-        }
-        .login-form button {
-            width: 100%;
-        }
-        .status-message {
-            padding: 10px;
-            margin-bottom: 10px;
-            border: 1px solid #000;
-        }
-        .hidden {
-            display: none;
-        }
-        .viewer-note {
-            text-align: center;
-            font-style: italic;
-            margin-bottom: 20px;
-            padding: 10px;
-            border: 1px solid #ccc;
-        }
-    </style>
-</head>
-<body>
-    <h1>Savage Worlds Adventure Edition</h1>
-    <div class="subtitle">Initiative Tracker</div>
-    
-    <div id="loginSection" class="login-form hidden">
-        <h3>GM Login</h3>
-        <input type="password" id="gmPassword" placeholder="Enter GM Password" onkeypress="if(event.key === 'Enter') login()">
-        <button onclick="login()">Login</button>
-        <div id="loginError" class="status-message hidden"></div>
-    </div>
-    
-    <div id="viewerNote" class="viewer-note hidden">
-        You are viewing as a player. Only the GM can make changes.
-        <button onclick="showLogin()">GM Login</button>
-    </div>
-    
-    <div id="mainContent" class="hidden">
-        <div id="gmSection" class="gm-section hidden">
-            <h3>GM Controls</h3>
-            <div class="gm-controls">
-                <button onclick="newEncounter()">New Encounter</button>
-                <button onclick="nextRound()">Next Round</button>
-                <button onclick="resetDeck()">Reset Deck</button>
-                <button onclick="clearInitiative()">Clear Initiative</button>
-                <button onclick="logout()">Logout</button>
-            </div>
-            <div style="margin-top: 10px;">Cards remaining: <span id="deckCount">54</span></div>
-        </div>
-        
-        <div id="participantSection" class="participant-setup hidden">
-            <h3>Participants</h3>
-            <div id="participantList"></div>
-            <button onclick="addParticipant()">Add Participant</button>
-        </div>
-        
-        <div class="initiative-tracker">
-            <h3>Initiative Order</h3>
-            <div id="initiativeOrder"></div>
-        </div>
-    </div>
-    
-    <script>
-        let isGM = false;
-        
-        function checkAuth() {
-            return fetch('/check_auth')
-                .then(response => response.json())
-                .then(data => {
-                    isGM = data.is_gm;
-                    updateUI();
-                    if (!isGM) {
-                        document.getElementById('viewerNote').classList.remove('hidden');
-                    }
-                    loadInitiative();
-                    return data;
-                });
-        }
-        
-        function updateUI() {
-            document.getElementById('mainContent').classList.remove('hidden');
-            document.getElementById('loginSection').classList.add('hidden');
-            
-            if (isGM) {
-                document.getElementById('gmSection').classList.remove('hidden');
-                document.getElementById('participantSection').classList.remove('hidden');
-                document.getElementById('viewerNote').classList.add('hidden');
-                renderParticipants();
-            } else {
-                document.getElementById('gmSection').classList.add('hidden');
-                document.getElementById('participantSection').classList.add('hidden');
-            }
-        }
-        
-        function showLogin() {
-            document.getElementById('loginSection').classList.remove('hidden');
-            document.getElementById('mainContent').classList.add('hidden');
-        }
-        
-        function login() {
-            const password = document.getElementById('gmPassword').value;
-            fetch('/login', {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify({password: password})
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    isGM = true;
-                    updateUI();
-                    loadInitiative();
-                } else {
-                    document.getElementById('loginError').textContent = 'Invalid password';
-                    document.getElementById('loginError').classList.remove('hidden');
-                }
-            });
-        }
-        
-        function logout() {
-            fetch('/logout', {method: 'POST'})
-                .then(() => {
-                    isGM = false;
-                    window.location.reload();
-                });
-        }
-        
-        function addParticipant() {
-                    // Send a request to the server to add an unnamed participant placeholder
-                    fetch('/add_participant_placeholder', {
-                        method: 'POST',
-                        headers: {'Content-Type': 'application/json'},
-                        body: JSON.stringify({}) // Send empty body, server handles name creation
-                    })
-                    .then(response => response.json())
-                    .then(data => {
-                        if (!data.success) {
-                            alert(data.error || "Failed to add participant.");
-                        }
-                        // Server broadcast handles the UI redraw and focus restoration
-                    });
-                }
-        
-        function toggleTrait(button) {
-                    const row = button.closest('.participant-row');
-                    const traitButtons = row.querySelectorAll('.trait-button');
-                    const trait = button.dataset.trait;
-                    
-                    // Toggle selection (Local DOM update - KEPT)
-                    button.classList.toggle('selected');
-                    
-                    // Handle Hesitant conflicts (Existing logic - KEPT)
-                    if (trait === 'hesitant' && button.classList.contains('selected')) {
-                        // Deselect and disable conflicting traits
-                        traitButtons.forEach(btn => {
-                            if (['level_headed', 'improved_level_headed', 'quick'].includes(btn.dataset.trait)) {
-                                btn.classList.remove('selected');
-                                btn.disabled = true;
-                            }
-                        });
-                    } else if (trait === 'hesitant' && !button.classList.contains('selected')) {
-                        // Re-enable traits when Hesitant is deselected
-                        traitButtons.forEach(btn => {
-                            if (['level_headed', 'improved_level_headed', 'quick'].includes(btn.dataset.trait)) {
-                                btn.disabled = false;
-                            }
-                        });
-                    } else if (['level_headed', 'improved_level_headed', 'quick'].includes(trait) && button.classList.contains('selected')) {
-                        // If selecting these, deselect and disable Hesitant
-                        traitButtons.forEach(btn => {
-                            if (btn.dataset.trait === 'hesitant') {
-                                btn.classList.remove('selected');
-                                btn.disabled = true;
-                            }
-                        });
-                    } else if (['level_headed', 'improved_level_headed', 'quick'].includes(trait) && !button.classList.contains('selected')) {
-                        // Check if any of these traits are still selected
-                        const anySelected = Array.from(traitButtons).some(btn => 
-                            ['level_headed', 'improved_level_headed', 'quick'].includes(btn.dataset.trait) && 
-                            btn.classList.contains('selected')
-                        );
-                        if (!anySelected) {
-                            // Re-enable Hesitant
-                            traitButtons.forEach(btn => {
-                                if (btn.dataset.trait === 'hesitant') {
-                                    btn.disabled = false;
-                                }
-                            });
-                        }
-                    }
-                    
-                    // Sync selected traits to the server ===
-                    const nameInput = row.querySelector('input[type="text"]');
-                    const index = parseInt(nameInput.dataset.index); // Get server index from input field
-                    const selectedTraits = Array.from(row.querySelectorAll('.trait-button.selected')).map(btn => btn.dataset.trait);
-
-                    if (isGM && !isNaN(index)) {
-                        fetch('/update_traits', {
-                            method: 'POST',
-                            headers: {'Content-Type': 'application/json'},
-                            body: JSON.stringify({index: index, traits: selectedTraits})
-                        })
-                        .then(response => response.json())
-                        .then(data => {
-                            if (data.error) {
-                                alert('Error updating traits: ' + data.error);
-                            }
-                            // SSE broadcast handles the UI redraw and persistence
-                        })
-                        .catch(error => {
-                            console.error('Network error during trait update:', error);
-                            alert('Network error while updating traits.');
-                        });
-                    }
-                }
-        
-        function renderParticipants() {
-                    if (!isGM) return;
-                
-                    const list = document.getElementById('participantList');
-                    const currentRows = Array.from(list.querySelectorAll('.participant-row'));
-                    const rowsToRemove = new Set(currentRows);
-
-                    // --- CRITICAL ADDITION: Preserve Focus State ---
-                    let activeElement = document.activeElement;
-                    let focusedInputIndex = -1;
-                    let focusedInputValue = null;
-                    if (activeElement && activeElement.tagName === 'INPUT' && activeElement.closest('.participant-row')) {
-                        // Get the server index before it's potentially removed/re-rendered
-                        focusedInputIndex = parseInt(activeElement.dataset.index);
-                        focusedInputValue = activeElement.value; // Store the actual typed value
-                    }
-                    // ------------------------------------------------
-
-                    fetch('/get_participants')
-                        .then(response => response.json())
-                        .then(data => {
-                            const serverParticipants = data.participants;
-
-                            serverParticipants.forEach((p, index) => {
-                                // Find the row by checking if the input's current value matches the server's name
-                                let row = currentRows.find(r => {
-                                    const input = r.querySelector('input[type="text"]');
-                                    return input && input.value === p.name;
-                                });
-
-                                if (row) {
-                                    rowsToRemove.delete(row);
-                                }
-
-                                const traitsArray = Array.isArray(p.traits) ? p.traits : [];
-                                const hasHesitant = traitsArray.includes('hesitant');
-                                const hasOthers = traitsArray.some(t => ['level_headed', 'improved_level_headed', 'quick'].includes(t));
-
-                                // Build trait buttons HTML
-                                const traitButtonsHTML = `
-                                    <button class="trait-button ${traitsArray.includes('level_headed') ? 'selected' : ''}" 
-                                            data-trait="level_headed" ${hasHesitant ? 'disabled' : ''} onclick="toggleTrait(this)">Level Headed</button>
-                                    <button class="trait-button ${traitsArray.includes('improved_level_headed') ? 'selected' : ''}" 
-                                            data-trait="improved_level_headed" ${hasHesitant ? 'disabled' : ''} onclick="toggleTrait(this)">Improved Level Headed</button>
-                                    <button class="trait-button ${traitsArray.includes('quick') ? 'selected' : ''}" 
-                                            data-trait="quick" ${hasHesitant ? 'disabled' : ''} onclick="toggleTrait(this)">Quick</button>
-                                    <button class="trait-button ${traitsArray.includes('hesitant') ? 'selected' : ''}" 
-                                            data-trait="hesitant" ${hasOthers ? 'disabled' : ''} onclick="toggleTrait(this)">Hesitant</button>
-                                `;
-
-                                // Show Deal In button only if participant hasn't drawn any cards
-                                const shouldShowDealIn = !p.has_drawn;
-                                const dealInButtonHTML = shouldShowDealIn
-                                    ? `<button class="deal-in-button" onclick="dealIn(${index})">Deal In</button>`
-                                    : '';
-                                    
-                                let nameValue = p.name;
-                                
-                                // --- CRITICAL FIX: Restore Value from Focus State ---
-                                // Check if the participant is the one that was actively being typed into
-                                if (index === focusedInputIndex && focusedInputValue !== null) {
-                                    nameValue = focusedInputValue;
-                                }
-                                // --------------------------------------------------------
-
-                                if (!row) {
-                                    // Participant row doesn't exist yet → create it
-                                    row = document.createElement('div');
-                                    row.className = 'participant-row';
-                                    row.innerHTML = `
-                                        <input type="text" value="${nameValue}" data-index="${index}" onblur="updateParticipantName(this)">
-                                        <div class="trait-buttons">${traitButtonsHTML}</div>
-                                        <button onclick="removeParticipant(this)">Remove</button>
-                                        ${dealInButtonHTML}
-                                    `;
-                                    list.appendChild(row);
-                                } else {
-                                    // Participant row exists → update traits, index, and Deal In button
-                                    const nameInput = row.querySelector('input[type="text"]');
-                                    nameInput.dataset.index = index; // Critical to update the server index!
-                                    nameInput.onblur = () => updateParticipantName(nameInput); // Re-apply handler
-
-                                    // Only overwrite the value if the input is NOT currently focused AND it's not the one we just restored
-                                    if (activeElement !== nameInput) {
-                                        nameInput.value = nameValue;
-                                    }
-                                    
-                                    const traitContainer = row.querySelector('.trait-buttons');
-                                    traitContainer.innerHTML = traitButtonsHTML;
-
-                                    // Handle Deal In button visibility and click handler
-                                    let dealInButton = row.querySelector('.deal-in-button');
-                                    if (shouldShowDealIn) {
-                                        if (!dealInButton) {
-                                            dealInButton = document.createElement('button');
-                                            dealInButton.className = 'deal-in-button';
-                                            dealInButton.textContent = 'Deal In';
-                                            row.appendChild(dealInButton);
-                                        }
-                                        dealInButton.onclick = () => dealIn(index); 
-                                        dealInButton.style.display = 'inline-block';
-                                    } else if (dealInButton) {
-                                        dealInButton.style.display = 'none';
-                                    }
-                                    
-                                    // Ensure the row is placed in the correct order in the DOM
-                                    if (list.children[index] !== row) {
-                                        list.insertBefore(row, list.children[index]);
-                                    }
-                                }
-                            });
-                            
-                            // 3. Remove any UI rows that were not found in the server data
-                            rowsToRemove.forEach(row => row.remove());
-
-                            // --- CRITICAL FIX: Re-focus the element after redraw ---
-                            if (focusedInputIndex !== -1) {
-                                // Find the row that matches the index we saved
-                                const matchingRow = Array.from(list.querySelectorAll('.participant-row')).find(row => {
-                                    const input = row.querySelector('input[type="text"]');
-                                    return input && parseInt(input.dataset.index) === focusedInputIndex;
-                                });
-                                
-                                if (matchingRow) {
-                                    matchingRow.querySelector('input[type="text"]').focus();
-                                }
-                            }
-                            // ------------------------------------------------------------
-
-                            // Find and focus on the latest added participant if nothing was being edited
-                            if (focusedInputIndex === -1 && serverParticipants.length > currentRows.length) {
-                                const lastIndex = serverParticipants.length - 1;
-                                const lastRow = list.children[lastIndex];
-                                if (lastRow) {
-                                    const input = lastRow.querySelector('input[type="text"]');
-                                    if (input) {
-                                        input.focus();
-                                        input.select(); // 🌟 NEW QoL FEATURE: Selects the default text
-                                    }
-                                }
-                            }
-                        });
-                }
-
-        function updateParticipantName(inputElement) {
-            const index = parseInt(inputElement.dataset.index);
-            const newName = inputElement.value.trim();
-
-            if (isNaN(index) || newName === '') {
-                return;
-            }
-
-            fetch('/update_name', {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify({index: index, name: newName})
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.error) {
-                    alert(data.error);
-                }
-                // Server broadcast handles the redraw.
-            });
-        }
+def broadcast_update(table, immediate=False):
+    """Broadcast state update to all clients connected to this table.
 
-        function removeParticipant(button) {
-                    const row = button.parentElement;
-                    // Get index from the input's data attribute, not DOM position
-                    const index = parseInt(row.querySelector('input[type="text"]').dataset.index);
-
-                    // Remove from server
-                    fetch('/remove_participant', {
-                        method: 'POST',
-                        headers: {'Content-Type': 'application/json'},
-                        body: JSON.stringify({index})
-                    })
-                    .then(response => response.json())
-                    .then(data => {
-                        // Now rely on SSE to remove the row
-                    });
-                }
-
-        function dealIn(index) {
-                    // Find the row using the *current* position in the UI list
-                    const row = document.querySelectorAll('.participant-row')[index];
-                    if (!row) return; 
-
-                    const traitButtons = row.querySelectorAll('.trait-button.selected');
-                    const traits = Array.from(traitButtons).map(btn => btn.dataset.trait);
-                    const nameInput = row.querySelector('input[type="text"]');
-                    const name = nameInput.value.trim();
-
-                    if (!name) {
-                        alert('Participant must have a name.');
-                        return;
-                    }
-
-                    // Temporarily disable the button to prevent double-clicks
-                    const dealInButton = row.querySelector('.deal-in-button');
-                    if (dealInButton) dealInButton.disabled = true;
-
-                    fetch('/deal_in', {
-                        method: 'POST',
-                        headers: {'Content-Type': 'application/json'},
-                        // NOTE: We rely on the server to find the participant by name if they are new,
-                        // or update the existing one if they are already in the list.
-                        body: JSON.stringify({name, traits})
-                    })
-                    .then(response => response.json())
-                    .then(data => {
-                        if (data.error) {
-                            alert(data.error);
-                        } else {
-                            // CRITICAL FIX: After a successful deal-in, the server has updated
-                            // the global list and broadcast the result. The participant is
-                            // now synchronized. The next renderParticipants will handle the redraw.
-                            
-                            // We don't need to manually update the UI here, as the SSE will trigger
-                            // the complete redraw via displayInitiative and renderParticipants.
-                            
-                            // Re-enable the button (though renderParticipants should hide it)
-                            if (dealInButton) dealInButton.disabled = false;
-                        }
-                    })
-                    .catch(() => {
-                        if (dealInButton) dealInButton.disabled = false;
-                    });
-                }
-        
-        function getParticipantsFromUI() {
-            const participants = [];
-            document.querySelectorAll('.participant-row').forEach(row => {
-                const nameInput = row.querySelector('input[type="text"]');
-                const traitButtons = row.querySelectorAll('.trait-button.selected');
-                if (nameInput.value.trim() !== '') {
-                    const selectedTraits = Array.from(traitButtons).map(btn => btn.dataset.trait);
-                    participants.push({
-                        name: nameInput.value.trim(),
-                        traits: selectedTraits
-                    });
-                }
-            });
-            return participants;
-        }
-        
-        function newEncounter() {
-            const participants = getParticipantsFromUI();
-            if (participants.length === 0) {
-                alert('Please add participants first');
-                return;
-            }
-            
-            fetch('/new_encounter', {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify({participants: participants})
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.error) {
-                    alert(data.error);
-                } else {
-                    displayInitiative(data);
-                    updateDeckCount();
-                    if (isGM) renderParticipants();
-                }
-            });
-        }
-        
-        function resetDeck() {
-            const participants = getParticipantsFromUI();
-            fetch('/reset_deck', {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify({participants: participants})
-            })
-            .then(response => response.json())
-            .then(data => {
-                displayInitiative(data);
-                updateDeckCount();
-                if (isGM) renderParticipants();
-            });
-        }
-        
-        function clearInitiative() {
-            if (confirm('Clear all participants and reset deck?')) {
-                fetch('/clear_initiative', {method: 'POST'})
-                    .then(response => response.json())
-                    .then(data => {
-                        displayInitiative(data);
-                        updateDeckCount();
-                        if (isGM) renderParticipants();
-                    });
-            }
-        }
-        
-        function drawAdditional(index) {
-            fetch('/draw_additional', {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify({index: index})
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.error) {
-                    alert(data.error);
-                } else {
-                    displayInitiative(data);
-                    updateDeckCount();
-                    if (isGM && Array.isArray(data.participants) && data.participants.length > 0) {
-                        renderParticipants();
-                    }
-                }
-            });
-        }
-        
-        function nextRound() {
-            const participants = getParticipantsFromUI();
-            fetch('/next_round', {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify({participants: participants})
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.error) {
-                    alert(data.error);
-                } else {
-                    displayInitiative(data);
-                    updateDeckCount();
-                    if (isGM) renderParticipants();
-                }
-            });
-        }
-        
-        function loadInitiative() {
-            fetch('/get_initiative')
-                .then(response => response.json())
-                .then(data => {
-                    displayInitiative(data);
-                    updateDeckCount();
-                });
-        }
-        
-        function displayInitiative(data) {
-            const orderDiv = document.getElementById('initiativeOrder');
-            let participantsToShow = data.participants;
-            if (!isGM) {
-                participantsToShow = participantsToShow.filter(p => p.cards && p.cards.length > 0);
-            }
-
-            if (participantsToShow.length === 0) {
-                orderDiv.innerHTML = '<p>No initiative drawn yet.</p>';
-                return;
-            }
+    Updates are coalesced for COALESCE_WINDOW seconds so a burst of GM edits goes
+    out as a single frame; latency-critical actions pass immediate=True.
+    """
+    table.mark_changed()
+    if immediate or COALESCE_WINDOW <= 0:
+        flush_update(table)
+    elif not table.flush_pending:
+        # In a worker thread: flushing takes the table's lock, which a writer may hold
+        # while it waits on the database
+        table.flush_pending = sse_server.run_later(COALESCE_WINDOW, flush_update, table)
+
+def flush_update(table):
+    """Send everything that changed since the last broadcast as one frame"""
+    # Frames are handed to the loop under the lock, so a coalesced flush in a worker
+    # and an immediate one in a request thread cannot deliver them out of order
+    with table.lock:
+        if tables.get(table.table_id) is not table:
+            # Closed; its topics may already belong to a new table with the same ID
+            return
+        start = time.perf_counter()
+        for (role, format), frame in table.publish():
+            sse_server.publish((table.table_id, role, format), frame)
+            BROADCASTS.labels(role, format).inc()
+    BROADCAST_SECONDS.observe(time.perf_counter() - start)
+
+def response_format():
+    """'compact' if the client's Accept header prefers it, otherwise 'json'"""
+    best = request.accept_mimetypes.best_match(['application/json', COMPACT_MIMETYPE])
+    return 'compact' if best == COMPACT_MIMETYPE else 'json'
+
+FORMAT_MIMETYPES = {'json': 'application/json', 'compact': COMPACT_MIMETYPE}
+
+def state_response(state):
+    """Reply with a TableState's cached encoding (participants plus deck_remaining), as
+    the GM sees it or as players do"""
+    role = 'gm' if session.get('is_gm') else 'player'
+    format = response_format()
+    body = state.encode(role, format)[1]
+    if len(body) >= GZIP_MIN_SIZE and accepts_gzip(request.headers.get('Accept-Encoding', '')):
+        response = Response(state.gzip(role, format), mimetype=FORMAT_MIMETYPES[format])
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(body, mimetype=FORMAT_MIMETYPES[format])
+    response.vary.add('Accept')
+    response.vary.add('Accept-Encoding')
+    return response
 
-                orderDiv.innerHTML = '';
-                participantsToShow.forEach((p, index) => {
-                    const row = document.createElement('div');
-                    row.className = 'initiative-row';
-                    row.style.display = 'flex';
-                    row.style.alignItems = 'center';
-                    row.style.gap = '10px'; // spacing between main sections
-
-                    // Rank + Name container
-                    const rankNameHTML = `
-                        <div class="rank-name" style="display:flex; align-items:center; gap:5px;">
-                            <div class="rank">${index + 1}.</div>
-                            <div class="participant-name">${p.name}</div>
-                        </div>
-                    `;
-
-                    // Cards
-                    const cardsHTML = p.cards.map(card => {
-                        const suitClass = card.rank === 'Joker' ? 'joker' : card.suit.toLowerCase();
-                        const activeClass = card === p.active_card ? 'active' : '';
-                        return `<div class="card ${suitClass} ${activeClass}">${card.display}</div>`;
-                    }).join('');
-                    const cardsContainerHTML = `<div class="cards" style="display:flex; gap:5px; flex-wrap:wrap;">${cardsHTML}</div>`;
-
-                    // Trait display
-                    const traitText = p.trait_display ? `<div class="edge-hindrance">${p.trait_display}</div>` : '';
-
-                    // GM-only button
-                    const drawButtonHTML = (isGM && p.cards && p.cards.length > 0)
-                    ? `<button style="margin-left:auto" onclick="drawAdditional(${index})">Draw Additional</button>`
-                    : '';
-
-                    row.innerHTML = rankNameHTML + cardsContainerHTML + traitText + drawButtonHTML;
-
-                    orderDiv.appendChild(row);
-
-                });
-        }
-        
-        function updateDeckCount() {
-            fetch('/deck_info')
-                .then(response => response.json())
-                .then(data => {
-                    const countElem = document.getElementById('deckCount');
-                    if (countElem) {
-                        countElem.textContent = data.remaining;
-                    }
-                });
-        }
-        
-        // Auto-refresh for non-GM users
-        //function startAutoRefresh() {
-        //    if (!isGM) {
-        //        setInterval(loadInitiative, 2000);
-        //    }
-        //}
-
-        let eventSource = null;
-
-        function setupSSE() {
-            if (eventSource) {
-                eventSource.close();
-            }
+# The journal every table mutation is logged to, once open_journal() has run
+journal = None
 
-            eventSource = new EventSource('/stream');
-
-            eventSource.onopen = function() {
-                console.log('Connected to server');
-            };
-
-            eventSource.onmessage = function(event) {
-                const data = JSON.parse(event.data);
-                displayInitiative({participants: data.participants});
-                const deckCountElem = document.getElementById('deckCount');
-                if (deckCountElem) {
-                    deckCountElem.textContent = data.deck_remaining;
-                }
-                if (isGM && document.getElementById('participantList')) {
-                    renderParticipants();
-                }
-            };
-
-            eventSource.onerror = function() {
-                console.log('Connection lost, reconnecting...', error);
-                eventSource.close();
-                setTimeout(setupSSE, 3000);
-            };
-        }
+def prepare_replay(table):
+    """Seed the table's RNG before a mutation so the journal can replay it exactly.
 
-        // Initialize at page load
-        checkAuth().then(() => {
-            setupSSE();
-});
+    Returns (seed, deck) for log_mutation; the deck is only recorded for a table's
+    first entry, since its starting shuffle happened outside any command.
+    """
+    if journal is None:
+        return None, None
+    seed = random.getrandbits(64)
+    table.rng.seed(seed)
+    return seed, table.deck.cards.hex() if table.journal_seq == 0 else None
+
+def log_mutation(table, op, data, replay):
+    """Append a mutation that was just applied to the journal (call with the table locked)"""
+    if journal is None:
+        return
+    seed, deck = replay
+    entry = {'t': table.table_id, 'op': op, 'd': data, 's': seed}
+    if deck is not None:
+        entry['deck'] = deck
+    table.journal_seq = journal.append(entry)
+
+def replay_mutation(entry):
+    """Re-apply one journal entry during recovery"""
+    if entry['op'] == 'close':
+        table = tables.get(entry['t'])
+        if table is not None and entry['n'] > table.journal_seq:
+            tables.remove(entry['t'])
+        return
+    table = tables.get_or_create(entry['t'])
+    if table is None or entry['n'] <= table.journal_seq:
+        return
+    before = table.state
+    if entry['op'] == 'restore':
+        table.load_state(entry['d'])
+    else:
+        if 'deck' in entry:
+            table.deck.cards = bytearray.fromhex(entry['deck'])
+        table.rng.seed(entry['s'])
+        if entry['op'] == 'batch':
+            apply_batch(table, entry['d'])
+        else:
+            COMMANDS[entry['op']][0](table, entry['d'])
+    table.journal_seq = entry['n']
+    table.mark_changed()
+    table.remember(before)
 
-    </script>
-</body>
-</html>
-'''
+def snapshot_tables():
+    return {'tables': {table.table_id: table.dump_state() for table in tables}}
 
-@app.route('/')
-def index():
-    return render_template_string(HTML_TEMPLATE)
+def open_journal(directory=JOURNAL_DIR):
+    """Restore tables from the journal in `directory`, then log every mutation to it.
 
-@app.route('/stream')
-def stream():
-    def event_stream():
-        q = Queue()
-        with message_queues_lock:
-            message_queues.append(q)
+    Call once at startup, before serving requests.
+    """
+    global journal
+    if backend.shared:
+        raise RuntimeError('The journal is for the in-memory backend; a shared database is already durable')
+    log = Journal(directory, snapshot_tables)
+    state, entries = log.recover()
+    for table_id, table_state in (state or {}).get('tables', {}).items():
+        table = tables.get_or_create(table_id)
+        if table is not None:
+            table.load_state(table_state)
+    for entry in entries:
+        replay_mutation(entry)
+    if entries:
+        log.take_snapshot()
+    log.start()
+    atexit.register(log.close)
+    journal = log
+    return len(entries)
+
+# GM operations by name: (function, immediate).  Each is `f(table, data)` and returns
+# (result, status), where a None result means "reply with the table state".
+COMMANDS = {}
+
+def command(name, immediate=False):
+    """Register a GM operation, available at POST /<name> and inside /batch"""
+    def register(f):
+        COMMANDS[name] = (f, immediate)
+
+        @wraps(f)
+        def view(table):
+            data = request.get_json(silent=True)
+            return run_command(table, name, data if isinstance(data, dict) else {})
+
+        table_routes.add_url_rule('/' + name, view_func=gm_required(table_required(view)), methods=['POST'])
+        return f
+    return register
+
+def run_command(table, name, data):
+    f, immediate = COMMANDS[name]
+    with backend.writing(table):
+        replay = prepare_replay(table)
+        before = table.state
+        checkpoint = table.checkpoint()
         try:
-            # Send initial state
-            initial_data = {
-                'participants': serialize_participants(participants),
-                'deck_remaining': len(deck.cards)
-            }
-            yield f"data: {json.dumps(initial_data)}\n\n"
-
-            # Keep connection alive and send updates
-            while True:
+            result, status = f(table, data)
+        except Exception:
+            # Whatever the command changed before failing must not reach the next
+            # published state, which the journal would have no record of
+            table.rollback(checkpoint)
+            app.logger.exception('Command %s failed', name)
+            result, status = {'error': f'Invalid {name} command'}, 400
+        if status == 200:
+            log_mutation(table, name, data, replay)
+            broadcast_update(table, immediate=immediate)
+            table.remember(before)
+    if result is None:
+        return state_response(table.state)
+    return jsonify(result), status
+
+def apply_batch(table, commands):
+    """Run commands in order, rolling the table back if one fails or raises.
+
+    Returns (results, index of the failed command or None, whether any command
+    asked for an immediate broadcast).
+    """
+    state = table.checkpoint()
+    results = []
+    immediate = False
+    for i, cmd in enumerate(commands):
+        op = cmd.get('op') if isinstance(cmd, dict) else None
+        if op not in COMMANDS:
+            result, status = {'error': f'Unknown command: {op}'}, 400
+        else:
+            data = resolve_references(cmd, results)
+            if data is None:
+                result, status = {'error': 'Reference to a command that created no participant'}, 400
+            else:
+                f, op_immediate = COMMANDS[op]
                 try:
-                    message = q.get(timeout=15)
-                    yield message
+                    result, status = f(table, data)
                 except Exception:
-                    # heartbeat to prevent buffering/timeout
-                    yield ": ping\n\n"
-        except GeneratorExit:
-            pass
-        finally:
-            with message_queues_lock:
-                if q in message_queues:
-                    message_queues.remove(q)
+                    # Malformed data a command did not check; it may have changed the
+                    # table before failing, so it fails like any other command
+                    app.logger.exception('Command %s failed', op)
+                    result, status = {'error': f'Invalid {op} command'}, 400
+                immediate = immediate or op_immediate
+        results.append(result if result is not None else {'success': True})
+        if status != 200:
+            table.rollback(state)
+            return results, i, immediate
+    return results, None, immediate
+
+def resolve_references(data, results):
+    """Replace "$N" values with the ID of the participant created by command N"""
+    resolved = {}
+    for key, value in data.items():
+        if isinstance(value, str) and value[:1] == '$' and value[1:].isdigit():
+            index = int(value[1:])
+            participant = results[index].get('participant') if index < len(results) else None
+            if participant is None:
+                return None
+            value = participant['id']
+        resolved[key] = value
+    return resolved
+
+STREAM_PATH = re.compile(r'^(?:/t/([^/]+))?/stream$')
+
+async def open_stream(req):
+    """Accept a stream connection on the SSE server and build its initial frame.
+
+    Finding the table may wait on its lock or the database, so that runs in a worker
+    thread; the loop only builds the frame, from what the view has already published.
+    """
+    opened = await asyncio.get_running_loop().run_in_executor(None, watch_stream, req)
+    if opened is None:
+        return None
+    topic, view, last_version = opened
+    return topic, view.start_frame(last_version)
+
+def watch_stream(req):
+    """The topic, view and last seen version for a stream request, or None to reject it"""
+    match = STREAM_PATH.match(req.path)
+    table = find_table(match.group(1) or DEFAULT_TABLE_ID) if match else None
+    if table is None:
+        return None
+    with table.lock:
+        backend.refresh(table)
+    role = req.query.get('role', [DEFAULT_ROLE])[0]
+    format = req.query.get('format', ['json'])[0]
+    if role not in ROLES or format not in FORMATS:
+        return None
+    table_id = table.table_id
+    if role == 'gm' and not hmac.compare_digest(req.query.get('token', [''])[0], stream_token(table_id)):
+        return None
+    # Reconnecting EventSources send Last-Event-ID; manual reconnects use the query string
+    last_event_id = req.headers.get('last-event-id') or req.query.get('last_event_id', [''])[0]
+    last_version = int(last_event_id) if last_event_id.isdigit() else None
+    return (table_id, role, format), table.watch(role, format), last_version
+
+def stream_token(table_id):
+    """Proof, added by /stream for GM sessions, that a stream may see the GM view"""
+    return hmac.new(app.secret_key.encode(), f'gm-stream:{table_id}'.encode(), hashlib.sha256).hexdigest()
+
+def latest_frame(topic):
+    """Full snapshot frame used to catch up subscribers that fell too far behind"""
+    table_id, role, format = topic
+    table = tables.get(table_id)
+    return table.snapshot_frame(role, format) if table is not None else b""
+
+def remote_change(table_id, version):
+    """A table changed in the shared store; push it to this process's subscribers"""
+    table = tables.get(table_id)
+    if table is None or table.version >= version:
+        return
+    with table.lock:
+        backend.refresh(table)
+    flush_update(table)
+
+backend = SQLiteBackend(STATE_DB) if STATE_DB else MemoryBackend()
+
+@app.before_request
+def start_backend():
+    backend.start(remote_change)
+
+# With a shared backend every worker listens on the SSE port and the kernel spreads
+# connections across them
+sse_server = SSEServer(SSE_HOST, SSE_PORT, open_stream, latest_frame,
+                       queue_depth=SSE_QUEUE_DEPTH, stall_timeout=SSE_STALL_TIMEOUT,
+                       reuse_port=backend.shared)
+
+metrics.gauge('savageinit_tables', 'Open tables', fn=lambda: len(tables))
+metrics.gauge('sse_subscribers', 'Connected stream subscribers', fn=lambda: sse_server.subscriber_count())
+metrics.gauge('sse_queued_frames', 'Frames buffered for subscribers right now', fn=lambda: sse_server.queued_frames())
+metrics.counter('sse_connections_opened_total', 'Stream connections accepted', fn=lambda: sse_server.accepted)
+metrics.counter('sse_connections_closed_total', 'Stream connections closed', fn=lambda: sse_server.closed)
+metrics.counter('sse_evicted_total', 'Subscribers disconnected for not reading', fn=lambda: sse_server.evicted)
+metrics.counter('sse_heartbeats_total', 'Heartbeats sent to idle subscribers', fn=lambda: sse_server.heartbeats)
+metrics.counter('sse_frames_sent_total', 'Frames written to subscribers, heartbeats included',
+                fn=lambda: sse_server.frames_sent)
+metrics.counter('sse_bytes_sent_total', 'Stream bytes written after compression', fn=lambda: sse_server.bytes_sent)
+metrics.register(sse_server.fanout_seconds)
+metrics.register(sse_server.write_backlog)
+
+class Asset:
+    """A file served from memory, with its gzipped form and ETag computed once"""
+    __slots__ = ('body', 'gzip', 'etag', 'mimetype', 'cache_control')
+
+    def __init__(self, body, mimetype, cache_control):
+        self.body = body
+        self.gzip = gzip.compress(body, 9, mtime=0) if len(body) >= GZIP_MIN_SIZE else None
+        self.etag = hashlib.sha256(body).hexdigest()[:16]
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+
+def build_assets():
+    """Load the page, script and stylesheet, naming each asset after a hash of its content.
+
+    Asset URLs change whenever their content does, so browsers may cache them
+    forever; the page itself is revalidated with its ETag on every load.
+    """
+    def read(name):
+        with open(os.path.join(STATIC_DIR, name), 'rb') as f:
+            return f.read()
+
+    page = read('index.html')
+    assets = {}
+    for name, mimetype in (('app.css', 'text/css'), ('app.js', 'application/javascript')):
+        asset = Asset(read(name), mimetype, 'public, max-age=31536000, immutable')
+        stem, ext = name.rsplit('.', 1)
+        hashed = f'{stem}.{asset.etag[:12]}.{ext}'
+        assets[hashed] = asset
+        page = page.replace(f'/static/{name}'.encode(), f'/static/{hashed}'.encode())
+    return Asset(page, 'text/html', 'no-cache'), assets
+
+PAGE, ASSETS = build_assets()
+
+def asset_response(asset):
+    """Serve an Asset, gzipped if the client accepts it, or 304 if the client has it"""
+    zipped = asset.gzip is not None and accepts_gzip(request.headers.get('Accept-Encoding', ''))
+    # Each encoding is a different representation, so each gets its own ETag
+    etag = asset.etag + '-gz' if zipped else asset.etag
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif zipped:
+        response = Response(asset.gzip, mimetype=asset.mimetype)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(asset.body, mimetype=asset.mimetype)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = asset.cache_control
+    response.vary.add('Accept-Encoding')
+    return response
 
-    return Response(stream_with_context(event_stream()), mimetype='text/event-stream')
+@app.route('/metrics')
+def metrics_page():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
+# The latest profiler of each kind, running or finished
+profilers = {'sample': None, 'requests': None}
 
-@app.route('/check_auth')
+@app.route('/profile', methods=['GET', 'POST', 'DELETE'])
+@gm_required
+def profile():
+    """Start a profiler (POST), stop the running ones (DELETE) or report on them and
+    the saved profiles (GET).
+
+    POST {"seconds": N, "interval": 0.005} samples every thread's stack for N seconds
+    into a collapsed-stack file; POST {"route": "next_round", "requests": K} runs the
+    next K requests to that route under cProfile into a pstats file, giving up after
+    "seconds" (MAX_PROFILE_SECONDS by default) if the route is not called K times.
+    """
+    if request.method == 'DELETE':
+        stopped = []
+        for kind, p in profilers.items():
+            if p is not None and not p.done.is_set():
+                p.stop()
+                stopped.append(kind)
+        return jsonify({'stopped': stopped})
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        kind = 'requests' if 'route' in data else 'sample'
+        current = profilers[kind]
+        if current is not None and not current.done.is_set():
+            return jsonify({'error': f'A {kind} profile is already running', 'output': current.path}), 409
+        try:
+            seconds = float(data.get('seconds', MAX_PROFILE_SECONDS if kind == 'requests' else 10))
+            if not 0 < seconds <= MAX_PROFILE_SECONDS:
+                raise ValueError(f'Seconds must be between 0 and {MAX_PROFILE_SECONDS}')
+            if kind == 'requests':
+                route = str(data['route']).strip('/')
+                endpoints = [e for e in app.view_functions if e.rpartition('.')[2] == route and e != 'profile']
+                count = int(data.get('requests', 10))
+                if not endpoints:
+                    raise ValueError(f'Unknown route: {route}')
+                if not 0 < count <= MAX_PROFILE_REQUESTS:
+                    raise ValueError(f'Requests must be between 1 and {MAX_PROFILE_REQUESTS}')
+                current = RequestProfiler(PROFILE_DIR, app.view_functions, endpoints, count, seconds)
+            else:
+                interval = float(data.get('interval', 0.005))
+                if not 0.001 <= interval <= 1:
+                    raise ValueError('Interval must be between 0.001 and 1 seconds')
+                current = SamplingProfiler(PROFILE_DIR, seconds, interval)
+        except (ValueError, TypeError) as e:
+            return jsonify({'error': str(e)}), 400
+        profilers[kind] = current.start()
+        return jsonify({'profiling': kind, 'output': current.path})
+
+    status = {}
+    for kind, p in profilers.items():
+        if p is not None:
+            status[kind] = {'output': p.path, 'done': p.done.is_set()}
+            if kind == 'requests':
+                status[kind].update(profiled=p.profiled, requests=p.count, seconds=p.seconds)
+            else:
+                status[kind].update(samples=p.samples, seconds=p.seconds)
+    saved = sorted(os.listdir(PROFILE_DIR)) if os.path.isdir(PROFILE_DIR) else []
+    return jsonify({'profilers': status, 'saved': [name for name in saved if not name.endswith('.tmp')]})
+
+@app.route('/static/<name>')
+def static_asset(name):
+    asset = ASSETS.get(name)
+    if asset is None:
+        return jsonify({'error': 'Not found'}), 404
+    return asset_response(asset)
+
+@table_routes.route('/')
+def index():
+    return asset_response(PAGE)
+
+@table_routes.route('/stream')
+def stream():
+    if current_table() is None:
+        return jsonify({'error': 'Unknown table or too many tables'}), 404
+    # Streams are served by the event-loop SSE server; EventSource follows the redirect
+    try:
+        sse_server.start()
+    except OSError:
+        return jsonify({'error': 'Live updates unavailable'}), 503
+    if SSE_URL:
+        base = SSE_URL
+    else:
+        host = urlsplit(request.host_url).hostname
+        if ':' in host:
+            host = f'[{host}]'
+        base = f'{request.scheme}://{host}:{SSE_PORT}'
+    prefix = '' if g.table_id == DEFAULT_TABLE_ID else f'/t/{g.table_id}'
+    args = request.args.to_dict()
+    if args.get('role') == 'gm':
+        if not session.get('is_gm'):
+            return jsonify({'error': 'GM authentication required'}), 403
+        args['token'] = stream_token(g.table_id)
+    query = f'?{urlencode(args)}' if args else ''
+    return redirect(f'{base}{prefix}/stream{query}', code=307)
+
+
+@table_routes.route('/check_auth')
 def check_auth():
     return jsonify({'is_gm': session.get('is_gm', False)})
 
-@app.route('/login', methods=['POST'])
+@table_routes.route('/login', methods=['POST'])
 def login():
     data = request.json
     if data.get('password') == GM_PASSWORD:
@@ -1016,366 +1298,381 @@ def login():
         return jsonify({'success': True})
     return jsonify({'success': False})
 
-@app.route('/logout', methods=['POST'])
+@table_routes.route('/logout', methods=['POST'])
 def logout():
     session.pop('is_gm', None)
     return jsonify({'success': True})
 
-@app.route('/get_participants')
+@table_routes.route('/tables')
+@gm_required
+def list_tables():
+    return jsonify({'tables': [{
+        'table_id': t.table_id,
+        'participants': len(t.state.participants),
+        'subscribers': sum(sse_server.subscriber_count((t.table_id, role, format))
+                           for role in ROLES for format in FORMATS),
+        'memory_bytes': t.memory_usage()
+    } for t in tables]})
+
+@table_routes.route('/close_table', methods=['POST'])
 @gm_required
-def get_participants():
-    return jsonify({'participants': [p.copy() for p in participants]})
+def close_table():
+    table = tables.get(g.table_id)
+    if table is None:
+        return jsonify({'error': 'Unknown table'}), 404
+    with table.lock:
+        if tables.remove(g.table_id) is not table:
+            return jsonify({'error': 'Unknown table'}), 404
+        log_mutation(table, 'close', None, (None, None))
+        backend.close_table(table)
+    # Open streams would otherwise wait on a table that no longer changes
+    for role in ROLES:
+        for format in FORMATS:
+            sse_server.close_topic((table.table_id, role, format))
+    if table.table_id == DEFAULT_TABLE_ID:
+        tables.get_or_create(DEFAULT_TABLE_ID)
+    return jsonify({'success': True})
 
-@app.route('/update_name', methods=['POST'])
+@table_routes.route('/get_participants')
 @gm_required
-def update_participant_name():
-    global participants
-    data = request.json
-    index = data.get('index')
+@table_state_required
+def get_participants(state):
+    if response_format() == 'compact':
+        body = '{"participants": [%s]}' % ','.join([p.encode_compact() for p in state.participants])
+        response = Response(body, mimetype=COMPACT_MIMETYPE)
+    else:
+        response = jsonify({'participants': serialize_participants(state.participants)})
+    response.vary.add('Accept')
+    return response
+
+@table_routes.route('/batch', methods=['POST'])
+@gm_required
+@table_required
+def batch(table):
+    """Apply a list of commands atomically: all of them succeed or none do.
+
+    Body: {"commands": [{"op": "add_participant_server", "name": "Orc"},
+                        {"op": "update_traits", "id": "$0", "traits": ["quick"]}]}
+    where "$N" stands for the ID of the participant created by command N.
+    Subscribers get a single update for the whole batch.
+    """
+    commands = (request.get_json(silent=True) or {}).get('commands')
+    if not isinstance(commands, list):
+        return jsonify({'error': 'Expected a list of commands'}), 400
+
+    with backend.writing(table):
+        replay = prepare_replay(table)
+        before = table.state
+        results, failed, immediate = apply_batch(table, commands)
+        if failed is not None:
+            return jsonify({'error': results[-1].get('error'), 'failed': failed, 'results': results}), 400
+
+        if commands:
+            log_mutation(table, 'batch', commands, replay)
+            broadcast_update(table, immediate=immediate)
+            # The whole batch is one step
+            table.remember(before)
+    format = response_format()
+    body = b'{"results": ' + json.dumps(results).encode() + b', "state": ' + table.state.encode('gm', format)[1] + b'}'
+    response = Response(body, mimetype=FORMAT_MIMETYPES[format])
+    response.vary.add('Accept')
+    return response
+
+def step_history(table, back):
+    """Undo or redo one change; subscribers get it like any other mutation"""
+    with backend.writing(table):
+        if not table.step(back):
+            return jsonify({'error': 'Nothing to undo' if back else 'Nothing to redo'}), 400
+        # Journaled as the state it arrived at: the history itself is not saved, so
+        # replaying "undo" after a restart could land somewhere else
+        log_mutation(table, 'restore', table.dump_state(), (None, None))
+        broadcast_update(table, immediate=True)
+    return state_response(table.state)
+
+@table_routes.route('/undo', methods=['POST'])
+@gm_required
+@table_required
+def undo(table):
+    return step_history(table, back=True)
+
+@table_routes.route('/redo', methods=['POST'])
+@gm_required
+@table_required
+def redo(table):
+    return step_history(table, back=False)
+
+@command('update_name')
+def update_participant_name(table, data):
+    p = table.find_participant(data)
     new_name = data.get('name')
 
-    if 0 <= index < len(participants):
-        old_name = participants[index]['name']
-        
+    if p is not None:
+        if not isinstance(new_name, str):
+            return {'error': 'Participant name required'}, 400
         # Check for name uniqueness among all other participants
-        if any(p['name'] == new_name for i, p in enumerate(participants) if i != index):
+        if table.by_name.get(new_name, p) is not p:
             # If the name is a duplicate, alert the user and do not update
-            return jsonify({'error': 'That name is already in use.'}), 400
+            return {'error': 'That name is already in use.'}, 400
         
-        participants[index]['name'] = new_name
-        broadcast_update()
-        return jsonify({'success': True})
-
-    return jsonify({'error': 'Invalid participant index'}), 400
+        table.rename_participant(p, new_name)
+        return {'success': True}, 200
 
-@app.route('/add_participant_server', methods=['POST'])
-@gm_required
-def add_participant_server():
-    global participants
-    data = request.json
-    name = data.get('name', '').strip() or f"New Participant {len(participants) + 1}"
-
-    # Ensure unique names (or handle duplicates by appending a number)
-    original_name = name
-    counter = 1
-    while any(p['name'] == name for p in participants):
-        name = f"{original_name} {counter}"
-        counter += 1
-
-    new_participant = {
-        'name': name,
-        'traits': [],
-        'cards': [],
-        'active_card': None,
-        'trait_display': '',
-        'additional_cards': [],
-        'has_drawn': False # CRITICAL: Starts as not dealt in
-    }
-    participants.append(new_participant)
-    broadcast_update()
-    return jsonify({'success': True, 'participant': new_participant})
+    return {'error': 'Invalid participant'}, 400
 
-@app.route('/update_traits', methods=['POST'])
-@gm_required
-def update_participant_traits():
-    global participants
-    data = request.json
-    index = data.get('index')
-    new_traits = data.get('traits', [])
+@command('add_participant_server')
+def add_participant_server(table, data):
+    name = data.get('name')
+    if name is not None and not isinstance(name, str):
+        return {'error': 'Participant name required'}, 400
+    name = (name or '').strip() or f"New Participant {len(table.participants) + 1}"
+
+    # Names are unique (duplicates get a number appended)
+    new_participant = table.add_participant(Participant(name)) # CRITICAL: Starts as not dealt in
+    return {'success': True, 'participant': new_participant.to_dict()}, 200
+
+@command('update_traits')
+def update_participant_traits(table, data):
+    participants = table.participants
+    p = table.find_participant(data)
+    new_traits = trait_mask(data.get('traits', []))
     
-    if 0 <= index < len(participants):
-        participants[index]['traits'] = new_traits
-        participants[index]['trait_display'] = get_traits_display(new_traits)
+    if p is not None:
+        index = locate(participants, p)
+        p.traits = new_traits
         
         # If the participant has cards, recalculate their active card based on new traits
-        if participants[index]['cards']:
-            cards = participants[index]['cards']
-            additional_cards = participants[index]['additional_cards']
-            participants[index]['active_card'] = determine_active_card(cards, new_traits, additional_cards)
+        if p.cards:
+            p.active_card = determine_active_card(p.cards, new_traits, p.additional_cards)
             
-            # Re-sort the initiative list if traits were changed while initiative is active
-            participants.sort(key=lambda p: (
-                p['active_card']['value'] if p.get('active_card') else -1,
-                p['active_card']['suit_value'] if p.get('active_card') else -1
-            ), reverse=True)
+            # Move them in the initiative list if traits were changed while initiative is active
+            reposition(participants, index)
         
-        broadcast_update()
-        return jsonify({'success': True})
+        return {'success': True}, 200
 
-    return jsonify({'error': 'Invalid participant index'}), 400
+    return {'error': 'Invalid participant'}, 400
 
-@app.route('/new_encounter', methods=['POST'])
-@gm_required
-def new_encounter():
-    global participants, deck, joker_drawn
-    
+@command('new_encounter', immediate=True)
+def new_encounter(table, data):
     # 1. Get participant data from the client (UI)
-    data = request.json
     participants_data = data.get('participants', [])
-
-    # 2. Re-initialize the global participants list based on the UI data
-    new_participants = []
+    # Checked up front: the table is cleared before they are added
+    if not isinstance(participants_data, list) or not all(
+            isinstance(p_data, dict) and isinstance(p_data.get('name'), str) for p_data in participants_data):
+        return {'error': 'Every participant needs a name'}, 400
+
+    # 2. Re-initialize the table's participants list based on the UI data
+    # CRITICAL: Overwrite the table's list with the synchronized list from the UI
+    table.clear_participants()
     for p_data in participants_data:
-        # Rebuild the full participant dictionary for each entry from the UI
-        new_participants.append({
-            'name': p_data['name'],
-            'traits': p_data.get('traits', []),
-            'cards': [], # Start with no cards
-            'active_card': None,
-            'trait_display': get_traits_display(p_data.get('traits', [])),
-            'additional_cards': [],
-            'has_drawn': False # They haven't drawn cards for THIS encounter yet
-        })
-    
-    # CRITICAL: Overwrite the global list with the synchronized list from the UI
-    participants = new_participants
+        # Rebuild each participant from the UI; they start with no cards and
+        # haven't drawn for THIS encounter yet
+        table.add_participant(Participant(p_data['name'], trait_mask(p_data.get('traits', []))))
 
     # 3. Reset deck and joker flag
-    deck = Deck()
-    joker_drawn = False
+    table.deck = Deck(table.rng)
+    table.joker_drawn = False
     
-    broadcast_update()
-    return jsonify({'participants': serialize_participants(participants)})
-
-@app.route('/next_round', methods=['POST'])
-@gm_required
-def next_round():
-    global participants, deck, joker_drawn
+    return None, 200
 
+@command('next_round', immediate=True)
+def next_round(table, data):
     # If a joker was drawn in the previous round, reset and reshuffle the deck
-    if joker_drawn:
-        deck = Deck()
-        joker_drawn = False 
+    if table.joker_drawn:
+        table.deck = Deck(table.rng)
+        table.joker_drawn = False 
     
     new_joker_drawn = False
     
-    # Iterate over the GLOBAL 'participants' list
-    for p in participants:
+    # Iterate over the table's 'participants' list
+    for p in table.participants:
         # **CRITICAL CHECK:** Ensure the entry is a valid participant with a name
-        if not p.get('name'):
+        if not p.name:
             continue # Skip participants who are not named
             
         # 1. Reset cards and status for the new round. 
-        # By clearing p['cards'], we force a new draw for everyone.
-        p['cards'] = []
-        p['active_card'] = None
-        p['additional_cards'] = [] 
-        p['has_drawn'] = True # Everyone is now dealt in for this round
+        # By clearing p.cards, we force a new draw for everyone.
+        p.clear_cards()
+        p.has_drawn = True # Everyone is now dealt in for this round
         
         # 2. Draw the initial card(s) and determine the active card
         # This function handles the drawing logic based on Level Headed/Hesitant/Quick
-        cards_drawn = draw_for_participant(p['traits'])
+        cards_drawn = draw_for_participant(table.deck, p.traits)
 
         # 3. Check for Joker draw and set the temporary flag
-        if any(c['rank'] == 'Joker' for c in cards_drawn):
+        if any(is_joker(c) for c in cards_drawn):
             new_joker_drawn = True
 
         # 4. Store the drawn cards and determine the active card
-        p['cards'] = cards_drawn
+        p.cards = cards_drawn
         # Note: determine_active_card internally calls get_active_from_initial
-        p['active_card'] = determine_active_card(p['cards'], p['traits'], p['additional_cards'])
+        p.active_card = determine_active_card(p.cards, p.traits, p.additional_cards)
 
 
-    # Update the global joker flag
-    joker_drawn = new_joker_drawn
+    # Update the table's joker flag
+    table.joker_drawn = new_joker_drawn
     
-    # Sort participants for the new initiative order
-    participants.sort(key=lambda p: (
-        p['active_card']['value'] if p.get('active_card') else -1,
-        p['active_card']['suit_value'] if p.get('active_card') else -1
-    ), reverse=True)
+    # Everyone drew, so rebuild the whole initiative order
+    table.participants.sort(key=initiative_key, reverse=True)
     
-    broadcast_update()
-    return jsonify({'participants': serialize_participants(participants)})
+    return None, 200
 
-@app.route('/reset_deck', methods=['POST'])
-@gm_required
-def reset_deck():
-    global participants, deck, joker_drawn
-    data = request.json
+@command('reset_deck', immediate=True)
+def reset_deck(table, data):
     participants_data = data.get('participants', [])
     
     # Reset deck to 54 cards and shuffle
-    deck = Deck()
-    joker_drawn = False
+    table.deck = Deck(table.rng)
+    table.joker_drawn = False
     
     # The client-side logic for reset_deck also sends participants, 
-    # but since the global list is authoritative, we don't rebuild it here.
-    # We only clear cards for the existing global participants (as done in new_encounter)
-    for p in participants:
-        p['cards'] = []
-        p['active_card'] = None
-        p['additional_cards'] = []
-        p['has_drawn'] = False
+    # but since the table's list is authoritative, we don't rebuild it here.
+    # We only clear cards for the existing participants (as done in new_encounter)
+    for p in table.participants:
+        p.clear_cards()
+        p.has_drawn = False
 
     
-    broadcast_update()
-    return jsonify({'participants': serialize_participants(participants)})
-
-@app.route('/clear_initiative', methods=['POST'])
-@gm_required
-def clear_initiative():
-    global deck, participants, joker_drawn
-    deck = Deck()
-    participants = []
-    joker_drawn = False
-    broadcast_update()
-    return jsonify({'participants': []})
-
-@app.route('/remove_participant', methods=['POST'])
-@gm_required
-def remove_participant():
-    global participants
-    data = request.json
-    index = data.get('index')
-    if 0 <= index < len(participants):
-        participants.pop(index)
-    broadcast_update()
-    return jsonify({'participants': serialize_participants(participants)})
-
-@app.route('/draw_additional', methods=['POST'])
-@gm_required
-def draw_additional():
-    global participants, deck, joker_drawn
-    data = request.json
-    index = data.get('index')
+    return None, 200
+
+@command('clear_initiative', immediate=True)
+def clear_initiative(table, data):
+    table.deck = Deck(table.rng)
+    table.clear_participants()
+    table.joker_drawn = False
+    return None, 200
+
+@command('remove_participant')
+def remove_participant(table, data):
+    p = table.find_participant(data)
+    if p is not None:
+        table.remove_participant(p)
+    return None, 200
+
+@command('draw_additional', immediate=True)
+def draw_additional(table, data):
+    participants = table.participants
+    p = table.find_participant(data)
     
-    if 0 <= index < len(participants):
-        additional_card = deck.draw(1)
+    if p is not None:
+        index = locate(participants, p)
+        additional_card = table.deck.draw(1)
         if additional_card:
-            card_dict = additional_card[0].to_dict()
-            participants[index]['cards'].append(card_dict)
+            card = additional_card[0]
+            # Track this as an additional card (they are always the last `extra` cards)
+            p.cards += bytes((card,))
+            p.extra += 1
             
             # Check for joker
-            if card_dict['rank'] == 'Joker':
-                joker_drawn = True
-            
-            # Track this as an additional card
-            if 'additional_cards' not in participants[index]:
-                participants[index]['additional_cards'] = []
-            participants[index]['additional_cards'].append(card_dict)
+            if is_joker(card):
+                table.joker_drawn = True
             
             # For additional cards, if it's higher than current active, use it
-            current_active = participants[index].get('active_card')
-            if current_active:
-                if (card_dict['value'], card_dict['suit_value']) > \
-                   (current_active['value'], current_active['suit_value']):
-                    participants[index]['active_card'] = card_dict
+            if p.active_card is not None:
+                if SORT_KEY[card] > SORT_KEY[p.active_card]:
+                    p.active_card = card
             else:
-                participants[index]['active_card'] = card_dict
+                p.active_card = card
 
             # Mark participant as having drawn
-            participants[index]['has_drawn'] = True
-    
-    # Re-sort by active card
-    participants.sort(key=lambda p: (
-        p['active_card']['value'] if p['active_card'] else -1,
-        p['active_card']['suit_value'] if p['active_card'] else -1
-    ), reverse=True)
-    
-    broadcast_update()
-    return jsonify({'participants': serialize_participants(participants)})
+            p.has_drawn = True
 
-@app.route('/reset', methods=['POST'])
-@gm_required
-def reset():
-    global deck, participants, joker_drawn
-    deck = Deck()
-    participants = []
-    joker_drawn = False
-    broadcast_update()
-    return jsonify({'participants': []})
-
-@app.route('/deal_in', methods=['POST'])
-@gm_required
-def deal_in():
-    global participants, deck, joker_drawn
-    data = request.json
-    name = data.get('name')
-    traits = data.get('traits', [])
-
-    if not name:
-        return jsonify({'error': 'Participant name required'}), 400
+            # Move them to their new place in the initiative order
+            reposition(participants, index)
     
-    # Look for existing participant
-    existing = next((p for p in participants if p['name'] == name), None)
+    return None, 200
+
+@command('reset', immediate=True)
+def reset(table, data):
+    table.deck = Deck(table.rng)
+    table.clear_participants()
+    table.joker_drawn = False
+    return None, 200
+
+@command('deal_in', immediate=True)
+def deal_in(table, data):
+    participants = table.participants
+    name = data.get('name')
+    traits = trait_mask(data.get('traits', []))
+
+    # Look for existing participant (by ID, or by name for older clients)
+    if 'id' in data:
+        existing = table.find_participant(data)
+        if existing is None:
+            return {'error': 'Invalid participant'}, 400
+    elif not name or not isinstance(name, str):
+        return {'error': 'Participant name required'}, 400
+    else:
+        existing = table.by_name.get(name)
 
-    if existing:
-        if existing.get('has_drawn'):
-            return jsonify({'error': 'Participant already dealt in'}), 400
+    if existing is not None:
+        index = locate(participants, existing)
+        if existing.has_drawn:
+            return {'error': 'Participant already dealt in'}, 400
         
         # Update traits and draw cards
-        existing['traits'] = traits
-        existing['trait_display'] = get_traits_display(traits)
-        cards = draw_for_participant(traits)
-        existing['cards'] = cards
-        existing['active_card'] = determine_active_card(cards, traits, [])
-        existing['has_drawn'] = True
+        existing.traits = traits
+        cards = draw_for_participant(table.deck, traits)
+        existing.cards = cards
+        existing.extra = 0
+        existing.active_card = determine_active_card(cards, traits, b"")
+        existing.has_drawn = True
 
-        if any(card['rank'] == 'Joker' for card in cards):
-            joker_drawn = True
+        if any(is_joker(card) for card in cards):
+            table.joker_drawn = True
 
     else:
         # New participant
-        cards = draw_for_participant(traits)
-        participant = {
-            'name': name,
-            'traits': traits,
-            'cards': cards,
-            'active_card': determine_active_card(cards, traits, []),
-            'trait_display': get_traits_display(traits),
-            'additional_cards': [],
-            'has_drawn': True
-        }
+        cards = draw_for_participant(table.deck, traits)
+        participant = Participant(name, traits, cards, has_drawn=True)
+        participant.active_card = determine_active_card(cards, traits, b"")
 
-        if any(card['rank'] == 'Joker' for card in cards):
-            joker_drawn = True
+        if any(is_joker(card) for card in cards):
+            table.joker_drawn = True
 
-        participants.append(participant)
+        table.add_participant(participant)
+        index = len(participants) - 1
 
-    # Sort initiative by active card, keep all participants intact
-    participants.sort(key=lambda p: (
-        p['active_card']['value'] if p.get('active_card') else -1,
-        p['active_card']['suit_value'] if p.get('active_card') else -1
-    ), reverse=True)
+    # Move the dealt-in participant to their place in the initiative order
+    reposition(participants, index)
 
-    broadcast_update()
-    return jsonify({'participants': serialize_participants(participants)})
+    return None, 200
 
 
 
 
-@app.route('/get_initiative')
-def get_initiative():
-    return jsonify({'participants': serialize_participants(participants)})
+@table_routes.route('/get_initiative')
+@table_state_required
+def get_initiative(state):
+    return state_response(state)
 
-@app.route('/deck_info')
-def deck_info():
-    return jsonify({'remaining': len(deck.cards)})
+@table_routes.route('/deck_info')
+@table_state_required
+def deck_info(state):
+    return jsonify({'remaining': len(state.deck)})
 
-def draw_for_participant(traits):
-    """Draw cards based on traits"""
+def draw_for_participant(deck, traits):
+    """Draw cards based on traits (a trait bitmask); returns the card codes as bytes"""
     num_cards = 1
     
     # Determine base number of cards to draw
-    if 'improved_level_headed' in traits:
+    if traits & IMPROVED_LEVEL_HEADED:
         num_cards = 3
-    elif 'level_headed' in traits:
+    elif traits & LEVEL_HEADED:
         num_cards = 2
-    elif 'hesitant' in traits:
+    elif traits & HESITANT:
         num_cards = 2
     
     cards = deck.draw(num_cards)
     
     # Handle Quick trait
-    if 'quick' in traits and cards:
-        first_card = cards[0]
-        if first_card.value() <= 5 and first_card.rank != 'Joker':
+    if traits & QUICK and cards:
+        first_card = CARDS[cards[0]]
+        if first_card.value <= 5 and first_card.rank != 'Joker':
             additional = deck.draw(1)
             if additional:
                 cards.extend(additional)
     
-    return [card.to_dict() for card in cards]
+    return bytes(cards)
 
 def determine_active_card(cards, traits, additional_cards):
     """Determine which card is active based on traits and additional cards"""
@@ -1390,10 +1687,9 @@ def determine_active_card(cards, traits, additional_cards):
             current_active = get_active_from_initial(initial_cards, traits)
             
             # Check if any additional card is better
-            best_additional = max(additional_cards, key=lambda c: (c['value'], c['suit_value']))
+            best_additional = max(additional_cards, key=SORT_KEY.__getitem__)
             
-            if (best_additional['value'], best_additional['suit_value']) > \
-               (current_active['value'], current_active['suit_value']):
+            if SORT_KEY[best_additional] > SORT_KEY[current_active]:
                 return best_additional
             
             return current_active
@@ -1410,24 +1706,24 @@ def get_active_from_initial(cards, traits):
         return None
     
     # 1. Joker Precedence: If a Joker is drawn, it supersedes all other rules.
-    jokers = [c for c in cards if c['rank'] == 'Joker']
+    jokers = [c for c in cards if is_joker(c)]
     if jokers:
         return jokers[0]
     
     # 2. Level Headed/Improved Level Headed: Use the highest card from all drawn cards.
-    if 'level_headed' in traits or 'improved_level_headed' in traits:
-        return max(cards, key=lambda c: (c['value'], c['suit_value']))
+    if traits & (LEVEL_HEADED | IMPROVED_LEVEL_HEADED):
+        return max(cards, key=SORT_KEY.__getitem__)
     
     # 3. Hesitant: Use the worst card (Joker check handled above).
-    elif 'hesitant' in traits:
-        return min(cards, key=lambda c: (c['value'], c['suit_value']))
+    elif traits & HESITANT:
+        return min(cards, key=SORT_KEY.__getitem__)
     
     # 4. Quick (and Default):
-    elif 'quick' in traits:
+    elif traits & QUICK:
         # If Quick triggered, there should be 2 cards.
         if len(cards) == 2:
-            if cards[0]['value'] <= 5 and cards[0]['rank'] != 'Joker':
-                return max(cards[0], cards[1], key=lambda c: (c['value'], c['suit_value']))
+            if CARDS[cards[0]].value <= 5 and not is_joker(cards[0]):
+                return max(cards[0], cards[1], key=SORT_KEY.__getitem__)
         
         # If Quick didn't trigger, or only one card was drawn, use the first card.
         return cards[0]
@@ -1437,44 +1733,201 @@ def get_active_from_initial(cards, traits):
         return cards[0]
 
 def get_traits_display(traits):
-    """Get display names for traits"""
-    trait_names = {
-        'level_headed': 'Level Headed',
-        'improved_level_headed': 'Improved Level Headed',
-        'quick': 'Quick',
-        'hesitant': 'Hesitant'
+    """Get display names for traits (a trait bitmask)"""
+    return TRAIT_DISPLAY[traits]
+
+@command('add_participant_placeholder')
+def add_participant_placeholder(table, data):
+    # Use a generic name that will be updated by the client; duplicates get a number appended
+    new_participant = table.add_participant(Participant("New Participant"))
+    return {'success': True, 'participant': new_participant.to_dict()}, 200
+
+# --- Monte Carlo initiative simulator ---
+# A simulated round is next_round on a fresh deck: everyone draws in roster order
+# with draw_for_participant, then the roster is stably sorted by active card.
+
+NO_CARD = 255
+
+if np is not None:
+    _KEYS = np.full(256, -1, np.int16)
+    _KEYS[:Card.COUNT] = SORT_KEY
+    # Min-key lookup, where a missing card must never win
+    _HIGH_KEYS = np.full(256, 1000, np.int16)
+    _HIGH_KEYS[:Card.COUNT] = SORT_KEY
+    _JOKERS = np.zeros(256, bool)
+    _JOKERS[Card.FIRST_JOKER:Card.COUNT] = True
+    # Cards that trigger Quick's redraw: value 5 or less, not a Joker
+    _LOW = np.zeros(256, bool)
+    _LOW[:Card.COUNT] = [c.value <= 5 and c.rank != 'Joker' for c in CARDS]
+
+def base_draw_count(traits):
+    if traits & IMPROVED_LEVEL_HEADED:
+        return 3
+    if traits & (LEVEL_HEADED | HESITANT):
+        return 2
+    return 1
+
+def simulate_active_cards(order, roster_traits):
+    """Active card codes (NO_CARD when the deck ran out) for a batch of rounds.
+
+    `order` is a (rounds, 54) uint8 array whose row r lists the cards of round r
+    in the order they are drawn.  Each participant's draw and active-card rules are
+    applied to every round at once, matching draw_for_participant and
+    get_active_from_initial card for card.
+    """
+    rounds = len(order)
+    rows = np.arange(rounds)
+    # Padding means draws past the end of the deck come back as NO_CARD
+    deck = np.full((rounds, Card.COUNT + 4), NO_CARD, np.uint8)
+    deck[:, :Card.COUNT] = order
+    pos = np.zeros(rounds, np.intp)
+    active = np.empty((rounds, len(roster_traits)), np.uint8)
+
+    for i, traits in enumerate(roster_traits):
+        count = base_draw_count(traits)
+        drawn = [deck[rows, pos + k] for k in range(count)]
+        pos = np.minimum(pos + count, Card.COUNT)
+        if traits & QUICK:
+            redraw = _LOW[drawn[0]]
+            drawn.append(np.where(redraw, deck[rows, pos], NO_CARD))
+            pos = np.minimum(pos + redraw, Card.COUNT)
+        cards = np.stack(drawn, axis=1)
+
+        if traits & (LEVEL_HEADED | IMPROVED_LEVEL_HEADED):
+            best = cards[rows, _KEYS[cards].argmax(axis=1)]
+        elif traits & HESITANT:
+            best = cards[rows, _HIGH_KEYS[cards].argmin(axis=1)]
+        elif traits & QUICK:
+            first, second = drawn
+            best = np.where((second != NO_CARD) & (_KEYS[second] > _KEYS[first]), second, first)
+        else:
+            best = drawn[0]
+
+        # A Joker beats every trait rule; the first one drawn is kept
+        jokers = _JOKERS[cards]
+        active[:, i] = np.where(jokers.any(axis=1), cards[rows, jokers.argmax(axis=1)], best)
+    return active
+
+def initiative_positions(active):
+    """0-based place of each participant per round, as next_round would sort them"""
+    keys = _KEYS[active]
+    order = np.argsort(-keys, axis=1, kind='stable')
+    positions = np.empty_like(order)
+    np.put_along_axis(positions, order, np.arange(active.shape[1]), axis=1)
+    return positions
+
+def shuffled_orders(rng, rounds, depth):
+    """`rounds` random draw orders, of which only the first `depth` cards are shuffled"""
+    order = np.tile(np.arange(Card.COUNT, dtype=np.uint8), (rounds, 1))
+    rows = np.arange(rounds)
+    # Partial Fisher-Yates: a round never draws more than `depth` cards
+    for k in range(min(depth, Card.COUNT - 1)):
+        swap = rng.integers(k, Card.COUNT, rounds)
+        picked = order[rows, swap]
+        order[rows, swap] = order[:, k]
+        order[:, k] = picked
+    return order
+
+def _simulate_numpy(roster_traits, rounds, seed):
+    rng = np.random.default_rng(seed)
+    size = len(roster_traits)
+    depth = sum(base_draw_count(t) + (1 if t & QUICK else 0) for t in roster_traits)
+    first = np.zeros(size, np.int64)
+    jokers = np.zeros(size, np.int64)
+    position_sum = np.zeros(size, np.int64)
+    before = np.zeros((size, size), np.int64)
+    done = 0
+    while done < rounds:
+        chunk = min(SIMULATION_CHUNK, rounds - done)
+        active = simulate_active_cards(shuffled_orders(rng, chunk, depth), roster_traits)
+        positions = initiative_positions(active)
+        first += np.bincount(positions.argmin(axis=1), minlength=size)
+        jokers += _JOKERS[active].sum(axis=0)
+        position_sum += positions.sum(axis=0)
+        for i in range(size):
+            before[i] += (positions[:, i:i + 1] < positions).sum(axis=0)
+        done += chunk
+    return first.tolist(), jokers.tolist(), position_sum.tolist(), before.tolist()
+
+def _simulate_python(roster_traits, rounds, seed):
+    rng = random.Random(seed)
+    size = len(roster_traits)
+    first = [0] * size
+    jokers = [0] * size
+    position_sum = [0] * size
+    before = [[0] * size for _ in range(size)]
+    for _ in range(rounds):
+        deck = Deck(rng)
+        keys = []
+        for i, traits in enumerate(roster_traits):
+            active = get_active_from_initial(draw_for_participant(deck, traits), traits)
+            if active is not None and is_joker(active):
+                jokers[i] += 1
+            keys.append(SORT_KEY[active] if active is not None else -1)
+        order = sorted(range(size), key=keys.__getitem__, reverse=True)
+        first[order[0]] += 1
+        for place, i in enumerate(order):
+            position_sum[i] += place
+            for j in order[place + 1:]:
+                before[i][j] += 1
+    return first, jokers, position_sum, before
+
+def simulate_initiative(roster, rounds=100000, seed=None):
+    """Estimate initiative odds for a roster by simulating `rounds` rounds.
+
+    `roster` is a list of {"name": ..., "traits": [...]} like the participants sent
+    to /new_encounter.  For each combatant this reports the probability of acting
+    first, of holding a Joker, of acting before each other combatant, and the
+    expected (1-based) position.  Uses NumPy when it is installed.
+    """
+    names = [p['name'] for p in roster]
+    if not names or len(set(names)) != len(names):
+        raise ValueError('Roster needs at least one participant and unique names')
+    limit = MAX_SIMULATION_ROUNDS if np is not None else MAX_SIMULATION_ROUNDS_PYTHON
+    if not 0 < rounds <= limit:
+        raise ValueError(f'Rounds must be between 1 and {limit}' + ('' if np is not None else ' without numpy'))
+    roster_traits = [trait_mask(p.get('traits', [])) for p in roster]
+
+    simulate = _simulate_numpy if np is not None else _simulate_python
+    first, jokers, position_sum, before = simulate(roster_traits, rounds, seed)
+    return {
+        'rounds': rounds,
+        'participants': [{
+            'name': name,
+            'traits': TRAIT_LISTS[roster_traits[i]],
+            'acts_first': first[i] / rounds,
+            'holds_joker': jokers[i] / rounds,
+            'expected_position': 1 + position_sum[i] / rounds,
+            'acts_before': {other: before[i][j] / rounds for j, other in enumerate(names) if j != i}
+        } for i, name in enumerate(names)]
     }
-    return ', '.join([trait_names.get(t, t) for t in traits]) if traits else ''
 
-@app.route('/add_participant_placeholder', methods=['POST'])
+@table_routes.route('/simulate', methods=['POST'])
 @gm_required
-def add_participant_placeholder():
-    global participants
-    
-    # Use a generic name that will be updated by the client
-    name = f"New Participant"
-    
-    # Ensure unique names (or handle duplicates by appending a number)
-    original_name = name
-    counter = 1
-    temp_name = original_name
-    while any(p['name'] == temp_name for p in participants):
-        temp_name = f"{original_name} {counter}"
-        counter += 1
-    name = temp_name
-
-    new_participant = {
-        'name': name,
-        'traits': [],
-        'cards': [],
-        'active_card': None,
-        'trait_display': '',
-        'additional_cards': [],
-        'has_drawn': False
-    }
-    participants.append(new_participant)
-    broadcast_update()
-    return jsonify({'success': True, 'participant': new_participant})
+def simulate():
+    """Run the simulator on the posted roster, or on the table's participants"""
+    data = request.get_json(silent=True) or {}
+    roster = data.get('participants')
+    if roster is None:
+        table = current_table()
+        if table is None:
+            return jsonify({'error': 'Unknown table or too many tables'}), 404
+        if backend.shared:
+            with table.lock:
+                backend.refresh(table)
+        roster = [{'name': p.name, 'traits': TRAIT_LISTS[p.traits]} for p in table.state.participants]
+    try:
+        rounds = int(data.get('rounds', 100000))
+        return jsonify(simulate_initiative(roster, rounds, data.get('seed')))
+    except (ValueError, TypeError, KeyError) as e:
+        return jsonify({'error': str(e) or 'Invalid roster'}), 400
+
+app.register_blueprint(table_routes)
+app.register_blueprint(table_routes, url_prefix='/t/<table_id>', name='table_scoped')
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000, host='0.0.0.0', threaded=True)
+    debug = True
+    # The debug reloader runs this file twice; only the serving child owns the journal
+    if JOURNAL_DIR and not backend.shared and (not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+        open_journal()
+    app.run(debug=debug, port=5000, host='0.0.0.0', threaded=True)
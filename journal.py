@@ -0,0 +1,184 @@
+"""Append-only journal with periodic snapshots.
+
+Every accepted mutation is appended as one JSON line.  A background writer
+thread writes whatever has accumulated and fsyncs it once per group, so
+requests never wait on the disk.  Every so often the writer starts a new
+journal segment, saves a full snapshot through the `snapshot` callback and
+deletes the segments the snapshot covers, so a restart only has to load the
+snapshot and replay a short tail.
+"""
+import json
+import os
+import threading
+import time
+
+SNAPSHOT_FILE = 'snapshot.json'
+SEGMENT_PREFIX = 'journal-'
+SEGMENT_SUFFIX = '.log'
+# Longest a group of entries waits before it is written and fsync'd
+COMMIT_INTERVAL = 0.05
+# Take a snapshot after this many entries, or this many seconds with any entries
+SNAPSHOT_EVERY = 5000
+SNAPSHOT_INTERVAL = 300
+
+def _fsync_directory(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:  # Not supported on this platform
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class Journal:
+    """Durable log of mutations for one data directory.
+
+    Entries are dicts; `append()` numbers them with a sequence number `n` and
+    returns it.  `snapshot()` is called on the writer thread and returns the
+    complete state as a JSON-serializable object; it must include, for every
+    entry it reflects, enough information to skip that entry on replay.
+    """
+
+    def __init__(self, directory, snapshot, commit_interval=COMMIT_INTERVAL,
+                 snapshot_every=SNAPSHOT_EVERY, snapshot_interval=SNAPSHOT_INTERVAL):
+        self.directory = directory
+        self.snapshot = snapshot
+        self.commit_interval = commit_interval
+        self.snapshot_every = snapshot_every
+        self.snapshot_interval = snapshot_interval
+        self.seq = 0
+        self.commits = 0
+        self._pending = []
+        self._cond = threading.Condition()
+        self._segment = None
+        self._since_snapshot = 0
+        self._last_snapshot = time.monotonic()
+        self._thread = None
+        self._closing = False
+        os.makedirs(directory, exist_ok=True)
+
+    def _segments(self):
+        names = [name for name in os.listdir(self.directory)
+                 if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)]
+        return sorted(names, key=lambda name: int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+
+    def recover(self):
+        """Return (snapshot state or None, journal entries in order).
+
+        A torn last line from a crash mid-write ends its segment.
+        """
+        state = None
+        try:
+            with open(os.path.join(self.directory, SNAPSHOT_FILE), 'rb') as f:
+                saved = json.load(f)
+            state = saved['state']
+            self.seq = saved['seq']
+        except FileNotFoundError:
+            pass
+        entries = []
+        for name in self._segments():
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break
+                    entries.append(entry)
+                    self.seq = max(self.seq, entry['n'])
+        self._since_snapshot = len(entries)
+        return state, entries
+
+    def start(self):
+        """Open a new segment and start the writer thread"""
+        if self._segment is None or self._segment.closed:
+            self._open_segment()
+        self._thread = threading.Thread(target=self._run, name='journal-writer', daemon=True)
+        self._thread.start()
+
+    def append(self, entry):
+        """Queue an entry for the next group commit; returns its sequence number"""
+        with self._cond:
+            self.seq += 1
+            entry['n'] = self.seq
+            self._pending.append(json.dumps(entry, separators=(',', ':')))
+            self._cond.notify()
+            return self.seq
+
+    def close(self):
+        """Write and fsync everything still queued, then stop the writer"""
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _open_segment(self):
+        name = f"{SEGMENT_PREFIX}{self.seq + 1:012d}{SEGMENT_SUFFIX}"
+        self._segment = open(os.path.join(self.directory, name), 'ab')
+        _fsync_directory(self.directory)
+        return name
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closing:
+                    self._cond.wait(self.snapshot_interval)
+                    if self._snapshot_due():
+                        break
+                batch, self._pending = self._pending, []
+                closing = self._closing
+            if batch:
+                self._commit(batch)
+            if closing:
+                self._segment.close()
+                return
+            if self._snapshot_due():
+                self.take_snapshot()
+            elif batch:
+                # Let the next group gather instead of fsyncing every entry on its own
+                time.sleep(self.commit_interval)
+
+    def _commit(self, batch):
+        self._segment.write(('\n'.join(batch) + '\n').encode())
+        self._segment.flush()
+        os.fsync(self._segment.fileno())
+        self.commits += 1
+        self._since_snapshot += len(batch)
+
+    def _snapshot_due(self):
+        if self._since_snapshot >= self.snapshot_every:
+            return True
+        return self._since_snapshot > 0 and time.monotonic() - self._last_snapshot >= self.snapshot_interval
+
+    def take_snapshot(self):
+        """Save a snapshot and drop the journal segments it makes redundant.
+
+        Only call this on the writer thread, or before start().
+        """
+        with self._cond:
+            batch, self._pending = self._pending, []
+        if self._segment is not None:
+            if batch:
+                self._commit(batch)
+            self._segment.close()
+        # Entries appended from here on go to the new segment; the snapshot taken
+        # below reflects at least everything in the older ones
+        with self._cond:
+            current = self._open_segment()
+        covered = [name for name in self._segments() if name != current]
+        state = self.snapshot()
+        with self._cond:
+            # Numbering must carry on past every entry the snapshot reflects
+            saved = {'seq': self.seq, 'state': state}
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(json.dumps(saved, separators=(',', ':')).encode())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        _fsync_directory(self.directory)
+        for name in covered:
+            os.remove(os.path.join(self.directory, name))
+        self._since_snapshot = 0
+        self._last_snapshot = time.monotonic()
@@ -0,0 +1,147 @@
+"""On-demand profilers that can be started on a running server.
+
+SamplingProfiler records every thread's stack at a fixed interval for a few
+seconds and writes them in the collapsed-stack format flame graph tools read
+(one "frame;frame;frame count" line per distinct stack).  RequestProfiler runs
+the next few calls of some view functions under cProfile and writes the
+combined pstats file.
+
+Neither leaves anything behind when it is not running: the sampler is a
+thread that exits when its time is up, and the request profiler swaps the view
+functions back once it has seen enough calls or run out of time.  Both can also
+be stopped early with stop(), which saves what they have collected so far.
+"""
+import cProfile
+import collections
+import os
+import pstats
+import sys
+import threading
+import time
+from functools import wraps
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _output_path(directory, kind, suffix):
+    os.makedirs(directory, exist_ok=True)
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(directory, f'{kind}-{stamp}{suffix}')
+    n = 1
+    while os.path.exists(path):
+        n += 1
+        path = os.path.join(directory, f'{kind}-{stamp}-{n}{suffix}')
+    return path
+
+class SamplingProfiler:
+    """Samples all threads' stacks every `interval` seconds for `seconds` seconds"""
+
+    def __init__(self, directory, seconds, interval):
+        self.path = _output_path(directory, 'sample', '.collapsed')
+        self.seconds = seconds
+        self.interval = interval
+        self.samples = 0
+        self.done = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """End sampling early and wait for what was collected to be written"""
+        self._stopping.set()
+        self.done.wait()
+
+    def _run(self):
+        me = threading.get_ident()
+        stacks = collections.Counter()
+        deadline = time.monotonic() + self.seconds
+        try:
+            while time.monotonic() < deadline and not self._stopping.is_set():
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(_frame_name(frame.f_code))
+                        frame = frame.f_back
+                    stack.append(names.get(ident, str(ident)))
+                    stacks[';'.join(reversed(stack))] += 1
+                self.samples += 1
+                self._stopping.wait(self.interval)
+            with open(self.path + '.tmp', 'w') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f'{stack} {count}\n')
+            os.replace(self.path + '.tmp', self.path)
+        finally:
+            self.done.set()
+
+class RequestProfiler:
+    """Profiles the next `count` calls of `endpoints` in `view_functions` (a Flask
+    app's endpoint -> view mapping), or those made within `seconds`, and writes
+    their combined pstats.
+
+    Calls are profiled one at a time; calls that arrive while another is being
+    profiled run normally and are not counted.
+    """
+
+    def __init__(self, directory, view_functions, endpoints, count, seconds):
+        self.path = _output_path(directory, 'requests', '.pstats')
+        self.view_functions = view_functions
+        self.count = count
+        self.seconds = seconds
+        self.profiled = 0
+        self.done = threading.Event()
+        self._stats = None
+        self._lock = threading.Lock()
+        self._originals = {endpoint: view_functions[endpoint] for endpoint in endpoints}
+        # Stops profiling if the route is not called often enough to finish on its own
+        self._timer = threading.Timer(seconds, self.stop)
+        self._timer.daemon = True
+
+    def start(self):
+        for endpoint, view in self._originals.items():
+            self.view_functions[endpoint] = self._wrap(view)
+        self._timer.start()
+        return self
+
+    def stop(self):
+        """Put the original views back and write whatever was collected"""
+        with self._lock:
+            self._finish()
+
+    def _wrap(self, view):
+        @wraps(view)
+        def profiled(*args, **kwargs):
+            if not self._lock.acquire(blocking=False):
+                return view(*args, **kwargs)
+            try:
+                if self.done.is_set():
+                    return view(*args, **kwargs)
+                profile = cProfile.Profile()
+                try:
+                    return profile.runcall(view, *args, **kwargs)
+                finally:
+                    profile.create_stats()
+                    if self._stats is None:
+                        self._stats = pstats.Stats(profile)
+                    else:
+                        self._stats.add(profile)
+                    self.profiled += 1
+                    if self.profiled >= self.count:
+                        self._finish()
+            finally:
+                self._lock.release()
+        return profiled
+
+    def _finish(self):
+        if self.done.is_set():
+            return
+        self._timer.cancel()
+        self.view_functions.update(self._originals)
+        if self._stats is not None:
+            self._stats.dump_stats(self.path)
+        self.done.set()
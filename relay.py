@@ -0,0 +1,288 @@
+"""Stand-alone relay that re-serves the tracker's live updates to many viewers.
+
+Run with: python3 relay.py --upstream <app host>:5001 [--port 5002]
+
+The relay holds one upstream stream per table (per distinct stream URL, so any
+query options are kept) and serves every downstream viewer from it, with its
+own buffering, heartbeats and slow-client eviction.  Frames are passed through
+untouched, so event IDs are the app's versions and viewers can resume with
+Last-Event-ID against either the relay or the app.  Point viewers at
+http://<relay host>:<port>/t/<table>/stream (or /stream for the default table);
+connection metrics are at /relay/metrics.
+"""
+import argparse
+import asyncio
+import collections
+import re
+import threading
+import time
+from urllib.parse import urlencode
+
+from sse import SSEServer, HEARTBEAT_INTERVAL, QUEUE_DEPTH, STALL_TIMEOUT
+
+STREAM_PATH = re.compile(r'^(?:/t/[A-Za-z0-9_-]{1,64})?/stream$')
+# Frames kept after the last snapshot before a fresh one is fetched from upstream
+HISTORY = 64
+# Seconds to wait for upstream before turning a viewer away
+CONNECT_TIMEOUT = 10
+RECONNECT_DELAY = 1
+# Upstream feeds with no viewers are closed after this many seconds
+IDLE_TIMEOUT = 60
+# Largest frame read from upstream (a full snapshot of a big table)
+MAX_FRAME_SIZE = 1 << 24
+
+def frame_id(frame):
+    """The numeric event ID of an encoded frame, or None for comments"""
+    if frame.startswith(b"id: "):
+        end = frame.find(b"\n")
+        if frame[4:end].isdigit():
+            return int(frame[4:end])
+    return None
+
+def frame_base(frame):
+    """The event ID a delta frame applies on top of, or None for snapshots"""
+    start = frame.find(b'"base": ', 0, 128)
+    if start < 0:
+        return None
+    end = frame.find(b",", start)
+    value = frame[start + 8:end]
+    return int(value) if value.isdigit() else None
+
+def chains(last_id, frames):
+    """Whether (id, base, frame) entries apply one after another from `last_id`"""
+    for number, base, _ in frames:
+        if base is not None and base != last_id:
+            return False
+        last_id = number
+    return True
+
+class UpstreamError(Exception):
+    pass
+
+class Feed:
+    """One upstream subscription and the frames needed to catch viewers up.
+
+    `snapshot` is the last full frame fetched from upstream (without
+    Last-Event-ID the app always starts with one) and `frames` holds every frame
+    received after it, as (id, base, frame).  A new viewer gets both; once
+    `frames` grows past HISTORY a fresh snapshot is fetched and the older frames
+    are dropped.  If the frames stop chaining (a delta whose base is not the
+    previous ID), a fresh snapshot is fetched too.
+    """
+
+    def __init__(self, relay, topic, path, query):
+        self.relay = relay
+        self.topic = topic
+        self.path = path
+        self.query = query
+        self.snapshot = b""
+        self.snapshot_id = -1
+        self.frames = collections.deque()
+        self.last_id = None
+        self.ready = asyncio.get_running_loop().create_future()
+        self.connected = False
+        self.received = 0
+        self.reconnects = 0
+        self.idle_since = None
+        self._refreshing = False
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    def catch_up(self, last_id):
+        """Frames a viewer that has seen `last_id` (None for a new viewer) still needs"""
+        if last_id is not None and last_id == self.last_id:
+            return b""
+        if last_id is not None and last_id >= self.snapshot_id:
+            missed = [entry for entry in self.frames if entry[0] > last_id]
+            if chains(last_id, missed):
+                return b"".join(frame for _, _, frame in missed)
+        if not chains(self.snapshot_id, self.frames):
+            # The viewer will fail to apply this and reconnect, by which time there
+            # is a snapshot the frames follow from
+            self._refresh()
+        return self.snapshot + b"".join(frame for _, _, frame in self.frames)
+
+    async def _open(self, last_id=None):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.relay.upstream_host, self.relay.upstream_port, limit=MAX_FRAME_SIZE),
+            CONNECT_TIMEOUT)
+        query = f"?{self.query}" if self.query else ""
+        head = f"GET {self.path}{query} HTTP/1.1\r\nHost: {self.relay.upstream_host}\r\nAccept: text/event-stream\r\n"
+        if last_id is not None:
+            head += f"Last-Event-ID: {last_id}\r\n"
+        writer.write((head + "\r\n").encode('latin-1'))
+        try:
+            status = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), CONNECT_TIMEOUT)
+        except BaseException:
+            writer.close()
+            raise
+        if not status.startswith((b"HTTP/1.1 200", b"HTTP/1.0 200")):
+            writer.close()
+            raise UpstreamError(status.split(b"\r\n", 1)[0].decode('latin-1'))
+        return reader, writer
+
+    async def _read_frame(self, reader):
+        # Frames end with a blank line; comments (heartbeats) carry no ID
+        while True:
+            frame = await reader.readuntil(b"\n\n")
+            if not frame.startswith(b":"):
+                return frame
+
+    async def _run(self):
+        while True:
+            writer = None
+            try:
+                reader, writer = await self._open(self.last_id)
+                self.connected = True
+                if self.last_id is None:
+                    self._set_snapshot(await self._read_frame(reader))
+                    if not self.ready.done():
+                        self.ready.set_result(True)
+                while True:
+                    self._receive(await self._read_frame(reader))
+            except asyncio.CancelledError:
+                raise
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+                    asyncio.LimitOverrunError, UpstreamError) as e:
+                if not self.ready.done():
+                    # Nobody has been served yet; let the waiting viewers fail
+                    self.ready.set_exception(UpstreamError(str(e) or type(e).__name__))
+                    return
+            finally:
+                self.connected = False
+                if writer is not None:
+                    writer.close()
+            self.reconnects += 1
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    def _set_snapshot(self, frame):
+        self.snapshot = frame
+        self.snapshot_id = frame_id(frame)
+        if self.last_id is None or self.snapshot_id > self.last_id:
+            self.last_id = self.snapshot_id
+        while self.frames and self.frames[0][0] <= self.snapshot_id:
+            self.frames.popleft()
+
+    def _receive(self, frame):
+        number = frame_id(frame)
+        self.received += 1
+        self.relay.server.publish(self.topic, frame)
+        if number is None:
+            return
+        self.last_id = number
+        if number > self.snapshot_id:
+            self.frames.append((number, frame_base(frame), frame))
+        if len(self.frames) > HISTORY:
+            self._refresh()
+
+    def _refresh(self):
+        if not self._refreshing:
+            self._refreshing = True
+            asyncio.get_running_loop().create_task(self._refresh_snapshot())
+
+    async def _refresh_snapshot(self):
+        # A separate short-lived request without Last-Event-ID returns the current snapshot
+        writer = None
+        try:
+            reader, writer = await self._open()
+            self._set_snapshot(await self._read_frame(reader))
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError, UpstreamError):
+            pass
+        finally:
+            self._refreshing = False
+            if writer is not None:
+                writer.close()
+
+class Relay:
+    def __init__(self, upstream_host, upstream_port, host, port, heartbeat=HEARTBEAT_INTERVAL,
+                 queue_depth=QUEUE_DEPTH, stall_timeout=STALL_TIMEOUT):
+        self.upstream_host = upstream_host
+        self.upstream_port = upstream_port
+        self.feeds = {}
+        self.started = time.time()
+        self.server = SSEServer(host, port, self.open_stream, self.snapshot, heartbeat=heartbeat,
+                                queue_depth=queue_depth, stall_timeout=stall_timeout)
+        self.server.routes['/relay/metrics'] = self.metrics
+
+    async def open_stream(self, req):
+        if not STREAM_PATH.match(req.path):
+            return None
+        # last_event_id is per viewer; everything else in the query picks the upstream feed
+        options = sorted((key, value) for key, values in req.query.items() if key != 'last_event_id'
+                         for value in values)
+        query = urlencode(options)
+        topic = f"{req.path}?{query}" if query else req.path
+        feed = self.feeds.get(topic)
+        if feed is None or (feed.ready.done() and feed.ready.exception() is not None):
+            feed = self.feeds[topic] = Feed(self, topic, req.path, query)
+        try:
+            await asyncio.wait_for(asyncio.shield(feed.ready), CONNECT_TIMEOUT)
+        except (asyncio.TimeoutError, UpstreamError):
+            return None
+        feed.idle_since = None
+        last_event_id = req.headers.get('last-event-id') or req.query.get('last_event_id', [''])[0]
+        return topic, feed.catch_up(int(last_event_id) if last_event_id.isdigit() else None)
+
+    def snapshot(self, topic):
+        feed = self.feeds.get(topic)
+        return feed.catch_up(None) if feed is not None else b""
+
+    async def _close_idle_feeds(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(IDLE_TIMEOUT / 4)
+            now = loop.time()
+            for topic, feed in list(self.feeds.items()):
+                if self.server.subscriber_count(topic):
+                    feed.idle_since = None
+                elif feed.idle_since is None:
+                    feed.idle_since = now
+                elif now - feed.idle_since >= IDLE_TIMEOUT:
+                    feed.task.cancel()
+                    del self.feeds[topic]
+
+    def metrics(self):
+        feeds = list(self.feeds.values())
+        return {
+            'uptime_seconds': round(time.time() - self.started),
+            'viewers': self.server.subscriber_count(),
+            'viewers_accepted': self.server.accepted,
+            'viewers_evicted': self.server.evicted,
+            'upstream_feeds': len(feeds),
+            'upstream_connected': sum(feed.connected for feed in feeds),
+            'feeds': [{
+                'stream': feed.topic,
+                'connected': feed.connected,
+                'viewers': self.server.subscriber_count(feed.topic),
+                'last_event_id': feed.last_id,
+                'frames_received': feed.received,
+                'reconnects': feed.reconnects
+            } for feed in feeds]
+        }
+
+    def start(self):
+        self.server.start()
+        asyncio.run_coroutine_threadsafe(self._close_idle_feeds(), self.server.loop)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--upstream', default='127.0.0.1:5001',
+                        help="the app's live update address (host:port of its SSE server)")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5002)
+    parser.add_argument('--heartbeat', type=float, default=HEARTBEAT_INTERVAL)
+    parser.add_argument('--queue-depth', type=int, default=QUEUE_DEPTH)
+    parser.add_argument('--stall-timeout', type=float, default=STALL_TIMEOUT)
+    args = parser.parse_args()
+    upstream_host, _, upstream_port = args.upstream.rpartition(':')
+    relay = Relay(upstream_host.strip('[]'), int(upstream_port), args.host, args.port, heartbeat=args.heartbeat,
+                  queue_depth=args.queue_depth, stall_timeout=args.stall_timeout)
+    relay.start()
+    print(f"Relaying {args.upstream} on {args.host}:{args.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+"""Event-loop driven Server-Sent Events fan-out.
+
+A single asyncio loop, running in a background thread, serves every stream
+connection.  Each subscriber is a small buffer plus one coroutine instead of
+an OS thread blocked on a queue, so thousands of spectators cost thousands of
+coroutines rather than thousands of threads.
+"""
+import asyncio
+import collections
+import inspect
+import json
+import threading
+import time
+import zlib
+from urllib.parse import urlsplit, parse_qs
+
+from metrics import Histogram
+
+HEARTBEAT_INTERVAL = 15
+REQUEST_TIMEOUT = 10
+MAX_REQUEST_SIZE = 8192
+# Frames buffered per subscriber before its backlog collapses into one snapshot
+QUEUE_DEPTH = 32
+# Subscribers whose socket has not accepted data for this long are disconnected
+STALL_TIMEOUT = 30
+SWEEP_INTERVAL = 5
+# Bytes the transport may hold for a client before we stop writing to it
+WRITE_BUFFER_LIMIT = 256 * 1024
+
+# Streams are gzipped for clients that accept it, with one compressor per
+# connection: its history window holds earlier frames, so the keys and cards
+# every frame repeats cost a few bytes each.  A full 32KB window with memLevel 5
+# compresses as well as the defaults at about 150KB per connection instead of 270KB.
+COMPRESS_LEVEL = 6
+COMPRESS_WINDOW_BITS = 15
+COMPRESS_MEM_LEVEL = 5
+
+HEARTBEAT = b": ping\n\n"
+
+RESPONSE_HEADERS = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Content-Type: text/event-stream\r\n"
+    b"Cache-Control: no-cache\r\n"
+    b"Connection: keep-alive\r\n"
+    b"Access-Control-Allow-Origin: *\r\n"
+    b"X-Accel-Buffering: no\r\n"
+    b"Vary: Accept-Encoding\r\n"
+)
+
+def stream_compressor():
+    """A gzip compressor for one connection's stream"""
+    return zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 16 + COMPRESS_WINDOW_BITS, COMPRESS_MEM_LEVEL)
+
+def accepts_gzip(accept_encoding):
+    """Whether an Accept-Encoding header value allows gzip"""
+    for item in accept_encoding.lower().split(","):
+        coding, _, params = item.partition(";")
+        if coding.strip() in ("gzip", "*"):
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+def _error_response(status):
+    return f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode()
+
+def _json_response(payload):
+    body = json.dumps(payload).encode()
+    return (b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n"
+            b"Connection: close\r\n\r\n" % len(body)) + body
+
+class StreamRequest:
+    """The parts of an incoming stream request that the application gets to see"""
+    __slots__ = ('path', 'query', 'headers')
+
+    def __init__(self, path, query, headers):
+        self.path = path
+        self.query = query
+        self.headers = headers
+
+class Subscriber:
+    """One connected client: pending frames plus a wakeup for its writer coroutine.
+
+    The buffer holds at most `depth` frames.  On overflow the backlog is dropped and
+    the subscriber is marked stale, so its next write is the latest full snapshot
+    however many updates it missed.
+    """
+    __slots__ = ('topic', 'buffer', 'depth', 'stale', 'closing', 'wakeup', 'transport', 'last_write', 'blocked_since')
+
+    def __init__(self, topic, transport, depth, now):
+        self.topic = topic
+        self.buffer = collections.deque()
+        self.depth = depth
+        self.stale = False
+        # Set when the topic is closed: send what is buffered, then disconnect
+        self.closing = False
+        self.wakeup = asyncio.Event()
+        self.transport = transport
+        self.last_write = now
+        self.blocked_since = None
+
+    def push(self, frame):
+        if not self.stale:
+            if len(self.buffer) < self.depth:
+                self.buffer.append(frame)
+            else:
+                self.buffer.clear()
+                self.stale = True
+        self.wakeup.set()
+
+class SSEServer:
+    """Serves text/event-stream connections and fans published frames out to them.
+
+    `open_stream(request)` is called on the loop thread for every new connection and
+    returns `(topic, initial_frame)`, or None to reject it; it may also be a coroutine.
+    `snapshot(topic)` returns the latest full state frame for a topic and is used to
+    catch up stale subscribers.  `publish()` may be called from any thread.
+
+    `routes` maps extra paths to functions returning JSON data, for status pages.
+    The counters and histograms below are only updated on the loop thread.
+    """
+
+    def __init__(self, host, port, open_stream, snapshot, heartbeat=HEARTBEAT_INTERVAL,
+                 queue_depth=QUEUE_DEPTH, stall_timeout=STALL_TIMEOUT, reuse_port=False, compress=True):
+        self.host = host
+        self.port = port
+        self.open_stream = open_stream
+        self.snapshot = snapshot
+        self.heartbeat = heartbeat
+        self.queue_depth = queue_depth
+        self.stall_timeout = stall_timeout
+        # Lets several processes share the port, each serving its share of the clients
+        self.reuse_port = reuse_port
+        self.compress = compress
+        self.evicted = 0
+        self.accepted = 0
+        self.closed = 0
+        self.heartbeats = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.fanout_seconds = Histogram('sse_fanout_seconds', 'Time to queue one published frame for every subscriber of its topic',
+                                        buckets=(0.00001, 0.0001, 0.001, 0.01, 0.1))
+        self.write_backlog = Histogram('sse_queue_depth', 'Frames waiting for a subscriber each time it was written to',
+                                     buckets=(1, 2, 4, 8, 16, 32, 64))
+        self.routes = {}
+        self.loop = None
+        # topic -> set of Subscribers.  Only ever touched on the loop thread, so
+        # fan-out needs no lock and never blocks publishers.
+        self.topics = {}
+        self._server = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._server is not None
+
+    def start(self):
+        """Start the event loop thread and listening socket (idempotent)"""
+        with self._start_lock:
+            if self._server is not None:
+                return
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='sse-loop', daemon=True)
+            thread.start()
+            try:
+                self._server = asyncio.run_coroutine_threadsafe(self._listen(), loop).result()
+            except BaseException:
+                loop.call_soon_threadsafe(loop.stop)
+                raise
+            self.loop = loop
+
+    async def _listen(self):
+        server = await asyncio.start_server(
+            self._handle, self.host, self.port,
+            limit=MAX_REQUEST_SIZE, backlog=1024, reuse_address=True, reuse_port=self.reuse_port or None
+        )
+        # Port 0 picks a free port; record which one
+        self.port = server.sockets[0].getsockname()[1]
+        asyncio.get_running_loop().create_task(self._sweep_loop())
+        return server
+
+    def publish(self, topic, frame):
+        """Queue an encoded frame for every subscriber of `topic` (thread-safe)"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._fanout, topic, frame)
+
+    def call_later(self, delay, callback, *args):
+        """Run `callback(*args)` on the loop after `delay` seconds (thread-safe).
+
+        Returns False when the loop is not running and nothing was scheduled.
+        """
+        if self.loop is None:
+            return False
+        self.loop.call_soon_threadsafe(self.loop.call_later, delay, callback, *args)
+        return True
+
+    def run_later(self, delay, fn, *args):
+        """Like call_later, but runs `fn(*args)` in a worker thread, for work that may block.
+
+        Returns False when the loop is not running and nothing was scheduled.
+        """
+        if self.loop is None:
+            return False
+        self.loop.call_soon_threadsafe(self.loop.call_later, delay, self.loop.run_in_executor, None, fn, *args)
+        return True
+
+    def close_topic(self, topic):
+        """Disconnect every subscriber of `topic` once it has been sent what is already
+        queued for it (thread-safe)"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._close_topic, topic)
+
+    def _close_topic(self, topic):
+        for sub in self.topics.pop(topic, ()):
+            sub.closing = True
+            sub.wakeup.set()
+
+    def subscriber_count(self, topic=None):
+        if topic is None:
+            return sum(len(subs) for subs in list(self.topics.values()))
+        return len(self.topics.get(topic, ()))
+
+    def _fanout(self, topic, frame):
+        start = time.perf_counter()
+        for sub in self.topics.get(topic, ()):
+            sub.push(frame)
+        self.fanout_seconds.observe(time.perf_counter() - start)
+
+    def queued_frames(self):
+        """Frames currently buffered across all subscribers"""
+        return sum(len(sub.buffer) for subs in list(self.topics.values()) for sub in list(subs))
+
+    async def _sweep_loop(self):
+        # One timer for every connection: heartbeats for idle ones, eviction for stuck ones
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(min(SWEEP_INTERVAL, self.heartbeat))
+            now = loop.time()
+            for subs in list(self.topics.values()):
+                for sub in list(subs):
+                    if sub.blocked_since is not None and now - sub.blocked_since > self.stall_timeout:
+                        self.evicted += 1
+                        sub.transport.abort()
+                    elif now - sub.last_write >= self.heartbeat and not sub.buffer:
+                        self.heartbeats += 1
+                        sub.push(HEARTBEAT)
+
+    async def _read_request(self, reader):
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), REQUEST_TIMEOUT)
+        lines = head.decode('latin-1').split("\r\n")
+        method, target, _ = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+        url = urlsplit(target)
+        return method, StreamRequest(url.path, parse_qs(url.query), headers)
+
+    async def _drain(self, sub, writer, loop):
+        sub.last_write = loop.time()
+        if writer.transport.get_write_buffer_size() > WRITE_BUFFER_LIMIT:
+            # The client is not keeping up; the sweep evicts it if this lasts too long
+            sub.blocked_since = sub.last_write
+            await writer.drain()
+            sub.blocked_since = None
+
+    def _write(self, writer, compressor, frames):
+        data = b"".join(frames)
+        if compressor is not None:
+            # Sync flush so the client can decode everything up to here right away
+            data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.frames_sent += len(frames)
+        self.bytes_sent += len(data)
+        writer.write(data)
+
+    async def _handle(self, reader, writer):
+        sub = None
+        try:
+            try:
+                method, req = await self._read_request(reader)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+                writer.write(_error_response("400 Bad Request"))
+                return
+            if method != "GET":
+                writer.write(_error_response("405 Method Not Allowed"))
+                return
+            if req.path in self.routes:
+                writer.write(_json_response(self.routes[req.path]()))
+                return
+            opened = self.open_stream(req)
+            if inspect.isawaitable(opened):
+                opened = await opened
+            if opened is None:
+                writer.write(_error_response("404 Not Found"))
+                return
+            topic, initial = opened
+            self.accepted += 1
+
+            loop = asyncio.get_running_loop()
+            writer.transport.set_write_buffer_limits(high=WRITE_BUFFER_LIMIT)
+            sub = Subscriber(topic, writer.transport, self.queue_depth, loop.time())
+            self.topics.setdefault(topic, set()).add(sub)
+            compressor = None
+            if self.compress and accepts_gzip(req.headers.get("accept-encoding", "")):
+                compressor = stream_compressor()
+                writer.write(RESPONSE_HEADERS + b"Content-Encoding: gzip\r\n\r\n")
+            else:
+                writer.write(RESPONSE_HEADERS + b"\r\n")
+            self._write(writer, compressor, [initial])
+            await self._drain(sub, writer, loop)
+
+            while True:
+                await sub.wakeup.wait()
+                sub.wakeup.clear()
+                if reader.at_eof():
+                    # Client hung up; noticed on the next frame or heartbeat
+                    break
+                frames = []
+                if sub.stale:
+                    # Latest state wins: one snapshot replaces everything that was missed
+                    sub.stale = False
+                    frames.append(self.snapshot(topic))
+                frames.extend(sub.buffer)
+                sub.buffer.clear()
+                if frames:
+                    self.write_backlog.observe(len(frames))
+                    self._write(writer, compressor, frames)
+                    await self._drain(sub, writer, loop)
+                if sub.closing:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            if sub is not None:
+                self.closed += 1
+                subs = self.topics.get(sub.topic)
+                # A closed topic's subscribers are no longer listed under it
+                if subs is not None and sub in subs:
+                    subs.discard(sub)
+                    if not subs:
+                        del self.topics[sub.topic]
+            writer.close()
@@ -0,0 +1,783 @@
+// Every route is served under the table's URL prefix ('' for the default table)
+const TABLE_BASE = window.location.pathname.replace(/\/+$/, '');
+let isGM = false;
+
+function checkAuth() {
+    return fetch(`${TABLE_BASE}/check_auth`)
+        .then(response => response.json())
+        .then(data => {
+            isGM = data.is_gm;
+            updateUI();
+            if (!isGM) {
+                document.getElementById('viewerNote').classList.remove('hidden');
+            }
+            loadInitiative();
+            return data;
+        });
+}
+
+function updateUI() {
+    document.getElementById('mainContent').classList.remove('hidden');
+    document.getElementById('loginSection').classList.add('hidden');
+
+    if (isGM) {
+        document.getElementById('gmSection').classList.remove('hidden');
+        document.getElementById('participantSection').classList.remove('hidden');
+        document.getElementById('viewerNote').classList.add('hidden');
+    } else {
+        document.getElementById('gmSection').classList.add('hidden');
+        document.getElementById('participantSection').classList.add('hidden');
+    }
+}
+
+function showLogin() {
+    document.getElementById('loginSection').classList.remove('hidden');
+    document.getElementById('mainContent').classList.add('hidden');
+}
+
+function login() {
+    const password = document.getElementById('gmPassword').value;
+    fetch(`${TABLE_BASE}/login`, {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({password: password})
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            isGM = true;
+            updateUI();
+            loadInitiative();
+            // Switch the stream over to the GM view
+            setupSSE();
+        } else {
+            document.getElementById('loginError').textContent = 'Invalid password';
+            document.getElementById('loginError').classList.remove('hidden');
+        }
+    });
+}
+
+function logout() {
+    fetch(`${TABLE_BASE}/logout`, {method: 'POST'})
+        .then(() => {
+            isGM = false;
+            window.location.reload();
+        });
+}
+
+function addParticipant() {
+            // Send a request to the server to add an unnamed participant placeholder
+            fetch(`${TABLE_BASE}/add_participant_placeholder`, {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({}) // Send empty body, server handles name creation
+            })
+            .then(response => response.json())
+            .then(data => {
+                if (!data.success) {
+                    alert(data.error || "Failed to add participant.");
+                }
+                // Server broadcast handles the UI redraw and focus restoration
+            });
+        }
+
+function toggleTrait(button) {
+            const row = button.closest('.participant-row');
+            const traitButtons = row.querySelectorAll('.trait-button');
+            const trait = button.dataset.trait;
+
+            // Toggle selection (Local DOM update - KEPT)
+            button.classList.toggle('selected');
+
+            // Handle Hesitant conflicts (Existing logic - KEPT)
+            if (trait === 'hesitant' && button.classList.contains('selected')) {
+                // Deselect and disable conflicting traits
+                traitButtons.forEach(btn => {
+                    if (['level_headed', 'improved_level_headed', 'quick'].includes(btn.dataset.trait)) {
+                        btn.classList.remove('selected');
+                        btn.disabled = true;
+                    }
+                });
+            } else if (trait === 'hesitant' && !button.classList.contains('selected')) {
+                // Re-enable traits when Hesitant is deselected
+                traitButtons.forEach(btn => {
+                    if (['level_headed', 'improved_level_headed', 'quick'].includes(btn.dataset.trait)) {
+                        btn.disabled = false;
+                    }
+                });
+            } else if (['level_headed', 'improved_level_headed', 'quick'].includes(trait) && button.classList.contains('selected')) {
+                // If selecting these, deselect and disable Hesitant
+                traitButtons.forEach(btn => {
+                    if (btn.dataset.trait === 'hesitant') {
+                        btn.classList.remove('selected');
+                        btn.disabled = true;
+                    }
+                });
+            } else if (['level_headed', 'improved_level_headed', 'quick'].includes(trait) && !button.classList.contains('selected')) {
+                // Check if any of these traits are still selected
+                const anySelected = Array.from(traitButtons).some(btn => 
+                    ['level_headed', 'improved_level_headed', 'quick'].includes(btn.dataset.trait) && 
+                    btn.classList.contains('selected')
+                );
+                if (!anySelected) {
+                    // Re-enable Hesitant
+                    traitButtons.forEach(btn => {
+                        if (btn.dataset.trait === 'hesitant') {
+                            btn.disabled = false;
+                        }
+                    });
+                }
+            }
+
+            // Sync selected traits to the server ===
+            const nameInput = row.querySelector('input[type="text"]');
+            const id = nameInput.dataset.id; // Get the participant's server ID from the input field
+            const selectedTraits = Array.from(row.querySelectorAll('.trait-button.selected')).map(btn => btn.dataset.trait);
+
+            if (isGM && id) {
+                fetch(`${TABLE_BASE}/update_traits`, {
+                    method: 'POST',
+                    headers: {'Content-Type': 'application/json'},
+                    body: JSON.stringify({id: id, traits: selectedTraits})
+                })
+                .then(response => response.json())
+                .then(data => {
+                    if (data.error) {
+                        alert('Error updating traits: ' + data.error);
+                    }
+                    // SSE broadcast handles the UI redraw and persistence
+                })
+                .catch(error => {
+                    console.error('Network error during trait update:', error);
+                    alert('Network error while updating traits.');
+                });
+            }
+        }
+
+// Sync the GM's editable participant list with the participants from the stream
+function renderParticipants(serverParticipants) {
+            if (!isGM) return;
+
+            const list = document.getElementById('participantList');
+            const currentRows = Array.from(list.querySelectorAll('.participant-row'));
+            const rowsToRemove = new Set(currentRows);
+
+            // --- CRITICAL ADDITION: Preserve Focus State ---
+            let activeElement = document.activeElement;
+            let focusedInputId = null;
+            let focusedInputValue = null;
+            if (activeElement && activeElement.tagName === 'INPUT' && activeElement.closest('.participant-row')) {
+                // Get the participant ID before the row is potentially removed/re-rendered
+                focusedInputId = activeElement.dataset.id;
+                focusedInputValue = activeElement.value; // Store the actual typed value
+            }
+            // ------------------------------------------------
+
+            const rowsById = new Map(currentRows.map(r => [r.dataset.id, r]));
+
+            serverParticipants.forEach((p, index) => {
+                // Find the row by the participant's stable ID
+                let row = rowsById.get(p.id);
+
+                if (row) {
+                    rowsToRemove.delete(row);
+                }
+
+                const traitsArray = Array.isArray(p.traits) ? p.traits : [];
+                const hasHesitant = traitsArray.includes('hesitant');
+                const hasOthers = traitsArray.some(t => ['level_headed', 'improved_level_headed', 'quick'].includes(t));
+
+                // Build trait buttons HTML
+                const traitButtonsHTML = `
+                    <button class="trait-button ${traitsArray.includes('level_headed') ? 'selected' : ''}" 
+                            data-trait="level_headed" ${hasHesitant ? 'disabled' : ''} onclick="toggleTrait(this)">Level Headed</button>
+                    <button class="trait-button ${traitsArray.includes('improved_level_headed') ? 'selected' : ''}" 
+                            data-trait="improved_level_headed" ${hasHesitant ? 'disabled' : ''} onclick="toggleTrait(this)">Improved Level Headed</button>
+                    <button class="trait-button ${traitsArray.includes('quick') ? 'selected' : ''}" 
+                            data-trait="quick" ${hasHesitant ? 'disabled' : ''} onclick="toggleTrait(this)">Quick</button>
+                    <button class="trait-button ${traitsArray.includes('hesitant') ? 'selected' : ''}" 
+                            data-trait="hesitant" ${hasOthers ? 'disabled' : ''} onclick="toggleTrait(this)">Hesitant</button>
+                `;
+
+                // Show Deal In button only if participant hasn't drawn any cards
+                const shouldShowDealIn = !p.has_drawn;
+                const dealInButtonHTML = shouldShowDealIn
+                    ? `<button class="deal-in-button" onclick="dealIn('${p.id}')">Deal In</button>`
+                    : '';
+
+                let nameValue = p.name;
+
+                // --- CRITICAL FIX: Restore Value from Focus State ---
+                // Check if the participant is the one that was actively being typed into
+                if (p.id === focusedInputId && focusedInputValue !== null) {
+                    nameValue = focusedInputValue;
+                }
+                // --------------------------------------------------------
+
+                if (!row) {
+                    // Participant row doesn't exist yet → create it
+                    row = document.createElement('div');
+                    row.className = 'participant-row';
+                    row.dataset.id = p.id;
+                    row.dataset.traits = traitsArray.join(',');
+                    row.innerHTML = `
+                        <input type="text" value="${nameValue}" data-id="${p.id}" onblur="updateParticipantName(this)">
+                        <div class="trait-buttons">${traitButtonsHTML}</div>
+                        <button onclick="removeParticipant(this)">Remove</button>
+                        ${dealInButtonHTML}
+                    `;
+                    list.appendChild(row);
+                } else {
+                    // Participant row exists → update name, traits and Deal In button
+                    const nameInput = row.querySelector('input[type="text"]');
+
+                    // Only overwrite the value if the input is NOT currently focused AND it's not the one we just restored
+                    if (activeElement !== nameInput && nameInput.value !== nameValue) {
+                        nameInput.value = nameValue;
+                    }
+
+                    // Rebuild the trait buttons only when the traits changed
+                    const traitKey = traitsArray.join(',');
+                    if (row.dataset.traits !== traitKey) {
+                        row.dataset.traits = traitKey;
+                        row.querySelector('.trait-buttons').innerHTML = traitButtonsHTML;
+                    }
+
+                    // Handle Deal In button visibility and click handler
+                    let dealInButton = row.querySelector('.deal-in-button');
+                    if (shouldShowDealIn) {
+                        if (!dealInButton) {
+                            dealInButton = document.createElement('button');
+                            dealInButton.className = 'deal-in-button';
+                            dealInButton.textContent = 'Deal In';
+                            row.appendChild(dealInButton);
+                        }
+                        dealInButton.onclick = () => dealIn(p.id);
+                        dealInButton.style.display = 'inline-block';
+                    } else if (dealInButton) {
+                        dealInButton.style.display = 'none';
+                    }
+
+                    // Ensure the row is placed in the correct order in the DOM
+                    if (list.children[index] !== row) {
+                        list.insertBefore(row, list.children[index]);
+                    }
+                }
+            });
+
+            // 3. Remove any UI rows that were not found in the server data
+            rowsToRemove.forEach(row => row.remove());
+
+            // --- CRITICAL FIX: Re-focus the element after redraw ---
+            if (focusedInputId !== null) {
+                // Find the row that matches the ID we saved
+                const matchingRow = Array.from(list.querySelectorAll('.participant-row')).find(row => row.dataset.id === focusedInputId);
+
+                if (matchingRow) {
+                    matchingRow.querySelector('input[type="text"]').focus();
+                }
+            }
+            // ------------------------------------------------------------
+
+            // Find and focus on the latest added participant if nothing was being edited
+            if (focusedInputId === null && serverParticipants.length > currentRows.length) {
+                const lastIndex = serverParticipants.length - 1;
+                const lastRow = list.children[lastIndex];
+                if (lastRow) {
+                    const input = lastRow.querySelector('input[type="text"]');
+                    if (input) {
+                        input.focus();
+                        input.select(); // 🌟 NEW QoL FEATURE: Selects the default text
+                    }
+                }
+            }
+        }
+
+function updateParticipantName(inputElement) {
+    const id = inputElement.dataset.id;
+    const newName = inputElement.value.trim();
+
+    if (!id || newName === '') {
+        return;
+    }
+
+    fetch(`${TABLE_BASE}/update_name`, {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({id: id, name: newName})
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.error) {
+            alert(data.error);
+        }
+        // Server broadcast handles the redraw.
+    });
+}
+
+function removeParticipant(button) {
+            const row = button.parentElement;
+            // Get the participant's ID from the row, not its DOM position
+            const id = row.dataset.id;
+
+            // Remove from server
+            fetch(`${TABLE_BASE}/remove_participant`, {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({id})
+            })
+            .then(response => response.json())
+            .then(data => {
+                // Now rely on SSE to remove the row
+            });
+        }
+
+function dealIn(id) {
+            // Find the participant's row by ID
+            const row = document.querySelector(`.participant-row[data-id="${id}"]`);
+            if (!row) return; 
+
+            const traitButtons = row.querySelectorAll('.trait-button.selected');
+            const traits = Array.from(traitButtons).map(btn => btn.dataset.trait);
+            const nameInput = row.querySelector('input[type="text"]');
+            const name = nameInput.value.trim();
+
+            if (!name) {
+                alert('Participant must have a name.');
+                return;
+            }
+
+            // Temporarily disable the button to prevent double-clicks
+            const dealInButton = row.querySelector('.deal-in-button');
+            if (dealInButton) dealInButton.disabled = true;
+
+            fetch(`${TABLE_BASE}/deal_in`, {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                // The server deals in the existing participant with this ID
+                body: JSON.stringify({id, name, traits})
+            })
+            .then(response => response.json())
+            .then(data => {
+                if (data.error) {
+                    alert(data.error);
+                } else {
+                    // CRITICAL FIX: After a successful deal-in, the server has updated
+                    // the global list and broadcast the result. The participant is
+                    // now synchronized. The next renderParticipants will handle the redraw.
+
+                    // We don't need to manually update the UI here, as the SSE will trigger
+                    // the complete redraw via displayInitiative and renderParticipants.
+
+                    // Re-enable the button (though renderParticipants should hide it)
+                    if (dealInButton) dealInButton.disabled = false;
+                }
+            })
+            .catch(() => {
+                if (dealInButton) dealInButton.disabled = false;
+            });
+        }
+
+function getParticipantsFromUI() {
+    const participants = [];
+    document.querySelectorAll('.participant-row').forEach(row => {
+        const nameInput = row.querySelector('input[type="text"]');
+        const traitButtons = row.querySelectorAll('.trait-button.selected');
+        if (nameInput.value.trim() !== '') {
+            const selectedTraits = Array.from(traitButtons).map(btn => btn.dataset.trait);
+            participants.push({
+                name: nameInput.value.trim(),
+                traits: selectedTraits
+            });
+        }
+    });
+    return participants;
+}
+
+function newEncounter() {
+    const participants = getParticipantsFromUI();
+    if (participants.length === 0) {
+        alert('Please add participants first');
+        return;
+    }
+
+    fetch(`${TABLE_BASE}/new_encounter`, {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({participants: participants})
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.error) {
+            alert(data.error);
+        } else {
+            displayInitiative(data);
+            updateDeckCount();
+            if (isGM) renderParticipants(data.participants);
+        }
+    });
+}
+
+function resetDeck() {
+    const participants = getParticipantsFromUI();
+    fetch(`${TABLE_BASE}/reset_deck`, {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({participants: participants})
+    })
+    .then(response => response.json())
+    .then(data => {
+        displayInitiative(data);
+        updateDeckCount();
+        if (isGM) renderParticipants(data.participants);
+    });
+}
+
+function clearInitiative() {
+    if (confirm('Clear all participants and reset deck?')) {
+        fetch(`${TABLE_BASE}/clear_initiative`, {method: 'POST'})
+            .then(response => response.json())
+            .then(data => {
+                displayInitiative(data);
+                updateDeckCount();
+                if (isGM) renderParticipants(data.participants);
+            });
+    }
+}
+
+// route is 'undo' or 'redo'
+function stepHistory(route) {
+    fetch(`${TABLE_BASE}/${route}`, {method: 'POST'})
+        .then(response => response.json())
+        .then(data => {
+            if (data.error) {
+                alert(data.error);
+            } else {
+                displayInitiative(data);
+                updateDeckCount();
+                if (isGM) renderParticipants(data.participants);
+            }
+        });
+}
+
+function drawAdditional(id) {
+    fetch(`${TABLE_BASE}/draw_additional`, {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({id: id})
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.error) {
+            alert(data.error);
+        } else {
+            displayInitiative(data);
+            updateDeckCount();
+            if (isGM && Array.isArray(data.participants) && data.participants.length > 0) {
+                renderParticipants(data.participants);
+            }
+        }
+    });
+}
+
+function nextRound() {
+    const participants = getParticipantsFromUI();
+    fetch(`${TABLE_BASE}/next_round`, {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({participants: participants})
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.error) {
+            alert(data.error);
+        } else {
+            displayInitiative(data);
+            updateDeckCount();
+            if (isGM) renderParticipants(data.participants);
+        }
+    });
+}
+
+function loadInitiative() {
+    fetch(`${TABLE_BASE}/get_initiative`)
+        .then(response => response.json())
+        .then(data => {
+            if (data.error) {
+                return; // The GM has not set this table up yet
+            }
+            displayInitiative(data);
+            updateDeckCount();
+        });
+}
+
+// Initiative rows by participant ID, each remembering what it currently shows
+const initiativeRows = new Map();
+let initiativePass = 0;
+
+function cardHTML(card, activeCard) {
+    const suitClass = card.rank === 'Joker' ? 'joker' : card.suit.toLowerCase();
+    const activeClass = activeCard && card.display === activeCard.display ? 'active' : '';
+    return `<div class="card ${suitClass} ${activeClass}">${card.display}</div>`;
+}
+
+// Everything a row displays; rows are only touched when this changes
+function initiativeSignature(p) {
+    const cards = p.cards.map(card => card.display).join(',');
+    return `${isGM}|${p.name}|${p.trait_display}|${p.active_card ? p.active_card.display : ''}|${cards}`;
+}
+
+function createInitiativeRow(p) {
+    const row = document.createElement('div');
+    row.className = 'initiative-row';
+    row.style.display = 'flex';
+    row.style.alignItems = 'center';
+    row.style.gap = '10px'; // spacing between main sections
+    row.dataset.id = p.id;
+    row.innerHTML = `
+        <div class="rank-name" style="display:flex; align-items:center; gap:5px;">
+            <div class="rank"></div>
+            <div class="participant-name"></div>
+        </div>
+        <div class="cards" style="display:flex; gap:5px; flex-wrap:wrap;"></div>
+        <div class="edge-hindrance"></div>
+    `;
+    return {
+        row: row,
+        rank: row.querySelector('.rank'),
+        name: row.querySelector('.participant-name'),
+        cards: row.querySelector('.cards'),
+        traits: row.querySelector('.edge-hindrance'),
+        drawButton: null,
+        participant: null,
+        signature: null,
+        index: -1,
+        pass: 0
+    };
+}
+
+function patchInitiativeRow(entry, p) {
+    // Participants the stream did not touch keep the same object
+    if (entry.participant === p) return;
+    entry.participant = p;
+    const signature = initiativeSignature(p);
+    if (signature === entry.signature) return;
+    entry.signature = signature;
+
+    entry.name.textContent = p.name;
+    entry.cards.innerHTML = p.cards.map(card => cardHTML(card, p.active_card)).join('');
+    entry.traits.textContent = p.trait_display || '';
+    entry.traits.classList.toggle('hidden', !p.trait_display);
+
+    // GM-only button
+    const showDraw = isGM && p.cards && p.cards.length > 0;
+    if (showDraw && !entry.drawButton) {
+        entry.drawButton = document.createElement('button');
+        entry.drawButton.style.marginLeft = 'auto';
+        entry.drawButton.textContent = 'Draw Additional';
+        entry.drawButton.onclick = () => drawAdditional(p.id);
+        entry.row.appendChild(entry.drawButton);
+    }
+    if (entry.drawButton) {
+        entry.drawButton.classList.toggle('hidden', !showDraw);
+    }
+}
+
+// Indexes of a longest increasing subsequence of `values` (skipping -1 entries)
+function longestIncreasing(values) {
+    const tails = [];     // tails[k]: index ending the best run of length k + 1
+    const previous = [];
+    values.forEach((value, i) => {
+        if (value < 0) return;
+        let lo = 0, hi = tails.length;
+        while (lo < hi) {
+            const mid = (lo + hi) >> 1;
+            if (values[tails[mid]] < value) lo = mid + 1; else hi = mid;
+        }
+        previous[i] = lo > 0 ? tails[lo - 1] : -1;
+        tails[lo] = i;
+    });
+    const run = new Set();
+    for (let i = tails.length ? tails[tails.length - 1] : -1; i >= 0; i = previous[i]) {
+        run.add(i);
+    }
+    return run;
+}
+
+function displayInitiative(data) {
+    const orderDiv = document.getElementById('initiativeOrder');
+    let participantsToShow = data.participants;
+    if (!isGM) {
+        participantsToShow = participantsToShow.filter(p => p.cards && p.cards.length > 0);
+    }
+    document.getElementById('noInitiative').classList.toggle('hidden', participantsToShow.length > 0);
+
+    const pass = ++initiativePass;
+    const entries = participantsToShow.map((p, index) => {
+        let entry = initiativeRows.get(p.id);
+        if (!entry) {
+            entry = createInitiativeRow(p);
+            initiativeRows.set(p.id, entry);
+        }
+        entry.pass = pass;
+        patchInitiativeRow(entry, p);
+        if (entry.index !== index) {
+            entry.index = index;
+            entry.rank.textContent = `${index + 1}.`;
+        }
+        return entry;
+    });
+
+    // Drop rows for participants that are gone (or, for players, have no cards)
+    initiativeRows.forEach((entry, id) => {
+        if (entry.pass !== pass) {
+            entry.row.remove();
+            initiativeRows.delete(id);
+        }
+    });
+
+    // Rows already in the right relative order stay put; only the others move
+    const position = new Map(Array.from(orderDiv.children, (row, i) => [row, i]));
+    const stay = longestIncreasing(entries.map(entry => position.has(entry.row) ? position.get(entry.row) : -1));
+    let next = null;
+    for (let i = entries.length - 1; i >= 0; i--) {
+        const row = entries[i].row;
+        if (!stay.has(i)) {
+            orderDiv.insertBefore(row, next);
+        }
+        next = row;
+    }
+}
+
+function updateDeckCount() {
+    fetch(`${TABLE_BASE}/deck_info`)
+        .then(response => response.json())
+        .then(data => {
+            const countElem = document.getElementById('deckCount');
+            if (countElem && !data.error) {
+                countElem.textContent = data.remaining;
+            }
+        });
+}
+
+// Auto-refresh for non-GM users
+//function startAutoRefresh() {
+//    if (!isGM) {
+//        setInterval(loadInitiative, 2000);
+//    }
+//}
+
+let eventSource = null;
+// Participants as last seen on the stream, and the version they belong to
+let liveParticipants = [];
+let liveVersion = null;
+// The view the stream sends: the GM's full one, or what players see
+let liveRole = null;
+
+// The stream uses the compact format: participants are positional arrays, cards
+// their codes (0-51 by suit then rank 2 to A, 52 and 53 Jokers) and traits a bitmask
+const SUITS = ['Spades', 'Hearts', 'Diamonds', 'Clubs'];
+const RANKS = ['2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K', 'A'];
+const CARDS = [];
+SUITS.forEach((suit, i) => RANKS.forEach((rank, j) => CARDS.push({
+    rank, suit, display: `${rank} of ${suit}`, value: j + 2, suit_value: 3 - i
+})));
+CARDS.push({rank: 'Joker', suit: '', display: 'Joker', value: 15, suit_value: 4});
+CARDS.push(CARDS[52]);
+const TRAITS = ['level_headed', 'improved_level_headed', 'quick', 'hesitant'];
+const TRAIT_NAMES = ['Level Headed', 'Improved Level Headed', 'Quick', 'Hesitant'];
+
+function decodeTraits(mask) {
+    const picked = TRAITS.map((t, i) => (mask & (1 << i)) ? i : -1).filter(i => i >= 0);
+    return {traits: picked.map(i => TRAITS[i]), trait_display: picked.map(i => TRAIT_NAMES[i]).join(', ')};
+}
+
+function decodeCard(code) {
+    return code === null ? null : CARDS[code];
+}
+
+// Compact participant arrays back into the objects the rest of the page uses
+function decodeParticipant(role, p) {
+    if (role === 'gm') {
+        const [id, name, mask, hasDrawn, codes, extra, active] = p;
+        const cards = codes.map(decodeCard);
+        return {id, name, ...decodeTraits(mask), has_drawn: !!hasDrawn, cards,
+                additional_cards: cards.slice(cards.length - extra), active_card: decodeCard(active)};
+    }
+    const [id, name, mask, codes, active] = p;
+    return {id, name, trait_display: decodeTraits(mask).trait_display,
+            cards: codes.map(decodeCard), active_card: decodeCard(active)};
+}
+
+// Apply a snapshot or delta frame; returns false if a delta was missed
+function applyStateFrame(data) {
+    if (data.type !== 'delta') {
+        liveParticipants = data.participants.map(p => decodeParticipant(liveRole, p));
+        liveVersion = data.version;
+        return true;
+    }
+    if (liveVersion !== null && data.version <= liveVersion) {
+        return true; // Already applied
+    }
+    if (data.base !== liveVersion) {
+        return false;
+    }
+    const byId = new Map(liveParticipants.map(p => [p.id, p]));
+    data.remove.forEach(id => byId.delete(id));
+    data.upsert.forEach(p => {
+        const decoded = decodeParticipant(liveRole, p);
+        byId.set(decoded.id, decoded);
+    });
+    const order = data.order || liveParticipants.map(p => p.id);
+    liveParticipants = order.map(id => byId.get(id));
+    liveVersion = data.version;
+    return true;
+}
+
+function setupSSE() {
+    if (eventSource) {
+        eventSource.close();
+    }
+
+    const role = isGM ? 'gm' : 'player';
+    if (role !== liveRole) {
+        // Versions are shared between views but deltas are not; start from a snapshot
+        liveRole = role;
+        liveParticipants = [];
+        liveVersion = null;
+    }
+    // Resume from the last version we saw; the server replays what we missed
+    const resume = liveVersion !== null ? `&last_event_id=${liveVersion}` : '';
+    eventSource = new EventSource(`${TABLE_BASE}/stream?role=${role}&format=compact${resume}`);
+
+    eventSource.onopen = function() {
+        console.log('Connected to server');
+    };
+
+    eventSource.onmessage = function(event) {
+        const data = JSON.parse(event.data);
+        if (!applyStateFrame(data)) {
+            setupSSE();
+            return;
+        }
+        displayInitiative({participants: liveParticipants});
+        const deckCountElem = document.getElementById('deckCount');
+        if (deckCountElem) {
+            deckCountElem.textContent = data.deck_remaining;
+        }
+        if (isGM && document.getElementById('participantList')) {
+            renderParticipants(liveParticipants);
+        }
+    };
+
+    eventSource.onerror = function(error) {
+        console.log('Connection lost, reconnecting...', error);
+        eventSource.close();
+        setTimeout(setupSSE, 3000);
+    };
+}
+
+// Initialize at page load
+checkAuth().then(() => {
+    setupSSE();
+});